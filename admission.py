@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from jobs import RetryLater
+from metrics import REGISTRY
+
+
+logger = logging.getLogger(__name__)
+
+# Requêtes Redshift et transferts S3 simultanés (0 = pas de limite) et attente maximale d'un créneau
+REDSHIFT_CONCURRENCY = int(os.environ.get('REDSHIFT_CONCURRENCY', '0'))
+S3_CONCURRENCY = int(os.environ.get('S3_CONCURRENCY', '0'))
+DOWNSTREAM_WAIT_TIMEOUT = float(os.environ.get('DOWNSTREAM_WAIT_TIMEOUT', '30'))
+# Jobs en attente ou en cours au-delà desquels /wcwebhook répond 503 (0 = pas de limite)
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', '0'))
+RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '30'))
+# Le comptage d'une file durable est une requête : on le réutilise pendant cette durée
+PENDING_COUNT_TTL = float(os.environ.get('ADMISSION_PENDING_COUNT_TTL', '1'))
+
+REJECTIONS = REGISTRY.counter('dpe_admission_rejections_total',
+                              'Livraisons ou appels refusés faute de capacité', ['reason'])
+
+
+class Overloaded(RetryLater):
+    # Dans un job, remis en file plus tard par l'exécuteur, sans compter de tentative
+    def __init__(self, reason):
+        super().__init__(f"Capacité {reason} saturée")
+        self.reason = reason
+
+
+class Bulkhead:
+    # Borne le nombre d'appels simultanés vers une dépendance ; au-delà on attend un
+    # créneau au plus `timeout` secondes, puis Overloaded.
+    def __init__(self, name, limit, timeout=DOWNSTREAM_WAIT_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self._init()
+
+    def _init(self):
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.limit) if self.limit > 0 else None
+        self._stats = {'in_use': 0, 'waiting': 0, 'acquired': 0, 'rejected': 0, 'wait_seconds_total': 0.0}
+
+    def after_fork(self):
+        # Les créneaux pris par des threads du parent n'existent pas dans l'enfant
+        self._init()
+
+    @contextmanager
+    def slot(self):
+        if self._semaphore is None:
+            yield
+            return
+        with self._lock:
+            self._stats['waiting'] += 1
+        start = time.monotonic()
+        acquired = self._semaphore.acquire(timeout=self.timeout)
+        with self._lock:
+            self._stats['waiting'] -= 1
+            self._stats['wait_seconds_total'] += time.monotonic() - start
+            if acquired:
+                self._stats['acquired'] += 1
+                self._stats['in_use'] += 1
+            else:
+                self._stats['rejected'] += 1
+        if not acquired:
+            REJECTIONS.inc(reason=self.name)
+            logger.warning("Aucun créneau %s libéré en %.0fs", self.name, self.timeout)
+            raise Overloaded(self.name)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, limit=self.limit)
+
+
+class AdmissionController:
+    # Refuse les nouvelles livraisons quand la file de jobs est pleine, pour que
+    # WooCommerce relivre plus tard au lieu d'accumuler threads et mémoire ici.
+    def __init__(self, pending_count, max_pending=JOB_QUEUE_MAX, retry_after=RETRY_AFTER,
+                 count_ttl=PENDING_COUNT_TTL):
+        self.pending_count = pending_count
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.count_ttl = count_ttl
+        self._lock = threading.Lock()
+        self._cached = (0.0, 0)
+        self._stats = {'admitted': 0, 'rejected': 0}
+
+    def _pending(self):
+        now = time.monotonic()
+        with self._lock:
+            checked_at, count = self._cached
+            if now - checked_at < self.count_ttl:
+                return count
+        count = self.pending_count()
+        with self._lock:
+            self._cached = (now, count)
+        return count
+
+    def admit(self):
+        if self.max_pending <= 0:
+            return True
+        pending = self._pending()
+        with self._lock:
+            if pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                admitted = False
+            else:
+                self._stats['admitted'] += 1
+                # Compte la livraison admise jusqu'au prochain rafraîchissement
+                checked_at, count = self._cached
+                self._cached = (checked_at, count + 1)
+                admitted = True
+        if not admitted:
+            REJECTIONS.inc(reason='queue_full')
+        return admitted
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._cached = (0.0, 0)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, max_pending=self.max_pending, pending=self._cached[1])
@@ -1,19 +1,35 @@
-from flask import Flask, request, jsonify
-import hashlib
-import hmac
+from flask import Flask, request, jsonify, Response, g
 import os
+import json
 import logging
-import base64
 import csv
-import psycopg2
-import boto3
-from botocore.exceptions import NoCredentialsError
+import uuid
+from contextlib import contextmanager
+from admission import REDSHIFT_CONCURRENCY, S3_CONCURRENCY, AdmissionController, Bulkhead, Overloaded
+from batching import QueryBatcher
+from cache import TTLCache
+from dedup import DeliveryDeduplicator, dedup_keys
+from jobs import CANCELLED, DEAD, FAILED, JOB_QUEUE_URL, executor, register_handler
+from logging_setup import after_fork as logging_after_fork, configure_logging, stats as logging_stats
+from ingest import WEBHOOK_MAX_BYTES, PayloadTooLarge, keyring_from_env
+from metrics import (BYTES_UPLOADED, ORDER_DECISIONS, REGISTRY, REQUESTS, ROWS_RETURNED, SIGNATURE_KEYS,
+                     WEBHOOK_TOPICS, stage, stats_collector)
+from order_state import CANCEL, ORDER_LOST_JOB_GRACE, WAIT, OrderRules, OrderStateStore
+from recorder import WebhookRecorder
+from redshift_pool import ConnectionPool
+from s3_client import get_s3_client, get_transfer_config, reset_s3_client, start_warmup as start_s3_warmup
+from s3_stream import MultipartCsvUpload
+from singleflight import SingleFlight
+from topics import TopicRouter
+from unload import UNLOAD_IAM_ROLE, unload_to_s3
 
 
 app = Flask(__name__)
+# Un Content-Length annoncé au-delà de la limite est refusé (413) avant toute lecture
+app.config['MAX_CONTENT_LENGTH'] = WEBHOOK_MAX_BYTES
 
-# Configuration de logging
-logging.basicConfig(level=logging.DEBUG)
+# Configuration de logging : JSON écrit depuis un thread dédié (voir logging_setup)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Variables d'environnement
@@ -23,170 +39,561 @@ dbname = os.environ.get('REDSHIFT_DBNAME')
 user = os.environ.get('REDSHIFT_USER')
 password = os.environ.get('REDSHIFT_PASSWORD')
 woocommerce_secret = os.environ.get('WC_KEY')
-aws_access_key = os.environ.get('AWS_ACCESS_KEY')
-aws_secret_key = os.environ.get('AWS_SECRET_KEY')
+# Secrets acceptés : courant, précédent pendant une rotation, et secrets par boutique
+webhook_keys = keyring_from_env(woocommerce_secret, os.environ.get('WC_KEY_PREVIOUS'),
+                                os.environ.get('WC_KEYS'))
+
+# 'fichier' : CSV local puis upload ; 'stream' : curseur serveur vers upload multipart S3
+export_mode = os.environ.get('DPE_EXPORT_MODE', 'fichier')
+stream_fetch_size = int(os.environ.get('DPE_STREAM_FETCH_SIZE', '10000'))
+# Nombre de lignes par article commandé, et seuil (en lignes demandées par la commande)
+# à partir duquel l'extraction passe par UNLOAD plutôt que par psycopg2
+dpe_limit = int(os.environ.get('DPE_LIMIT', '5'))
+unload_threshold = int(os.environ.get('DPE_UNLOAD_THRESHOLD', '50000'))
+type_batiment = os.environ.get('DPE_TYPE_BATIMENT', 'maison')
+# Sujets WooCommerce qui déclenchent une extraction ; les autres sont acquittés sans rien faire
+order_topics = [topic for topic in os.environ.get('WEBHOOK_ORDER_TOPICS', 'order.created,order.updated').split(',')
+                if topic]
+
+# Cache des extraits déjà publiés sur S3, clé (note, limite, filtres)
+dpe_cache = TTLCache(ttl=float(os.environ.get('DPE_CACHE_TTL', '900')),
+                     maxsize=int(os.environ.get('DPE_CACHE_MAX', '256')))
+
+CSV_HEADER = ['num_dpe', 'nom', 'prenom', 'tel_mobile', 'email', 'code_postal', 'note_dpe']
+
+DPE_QUERY = """
+SELECT DISTINCT p.n_dpe AS num_dpe, MAX(lastname) AS nom, MAX(firstname) AS prenom,
+MAX(tel_mobile) AS tel_mobile, MAX(email) AS email, MAX(zipcode) AS code_postal,
+MAX(etiquette_dpe) AS note_dpe
+FROM vw_principale_tel_mobile p
+LEFT JOIN fact_dpe d ON d.n_dpe = p.n_dpe
+WHERE type_batiment = %s AND etiquette_dpe = %s
+GROUP BY p.n_dpe
+LIMIT %s
+"""
+
+# Variante groupée : plusieurs notes en une requête, lignes numérotées par note
+DPE_BATCH_QUERY = """
+SELECT num_dpe, nom, prenom, tel_mobile, email, code_postal, note_dpe FROM (
+    SELECT p.n_dpe AS num_dpe, MAX(lastname) AS nom, MAX(firstname) AS prenom,
+    MAX(tel_mobile) AS tel_mobile, MAX(email) AS email, MAX(zipcode) AS code_postal,
+    etiquette_dpe AS note_dpe,
+    ROW_NUMBER() OVER (PARTITION BY etiquette_dpe ORDER BY p.n_dpe) AS rang
+    FROM vw_principale_tel_mobile p
+    LEFT JOIN fact_dpe d ON d.n_dpe = p.n_dpe
+    WHERE type_batiment = %s AND etiquette_dpe IN %s
+    GROUP BY p.n_dpe, etiquette_dpe
+) numerotees
+WHERE rang <= %s
+"""
+
+
+def connect_redshift():
+    # Import différé : psycopg2 n'est chargé qu'à la première connexion
+    import psycopg2
+
+    # Keepalives TCP pour que les connexions gardées dans le pool ne soient pas coupées en silence
+    return psycopg2.connect(dbname=dbname, user=user, password=password,
+                            host=host or 'pw-cluster.cq6jh9anojbf.us-west-2.redshift.amazonaws.com',
+                            port=port or 5439,
+                            connect_timeout=int(os.environ.get('REDSHIFT_CONNECT_TIMEOUT', '10')),
+                            keepalives=1, keepalives_idle=60, keepalives_interval=10, keepalives_count=5)
+
+
+redshift_pool = ConnectionPool(connect_redshift)
+deduplicator = DeliveryDeduplicator()
+# Seules les commandes payées déclenchent une extraction, une seule fois par commande
+order_rules = OrderRules()
+order_states = OrderStateStore()
+
+# Appels simultanés bornés par dépendance, et file de jobs bornée côté webhook
+redshift_slots = Bulkhead('redshift', REDSHIFT_CONCURRENCY)
+s3_slots = Bulkhead('s3', S3_CONCURRENCY)
+admission = AdmissionController(executor.pending_count)
+
+# Capture optionnelle des livraisons pour bench.replay (WEBHOOK_RECORD_PATH)
+recorder = WebhookRecorder()
+recorder.init_app(app)
+
+
+@contextmanager
+def redshift_connection():
+    with redshift_slots.slot(), redshift_pool.connection() as conn:
+        yield conn
+
+
+def fetch_dpe_rows_batch(notes, limit):
+    with redshift_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(DPE_BATCH_QUERY, (type_batiment, tuple(notes), limit))
+        rows_by_note = {}
+        for row in cursor.fetchall():
+            rows_by_note.setdefault(row[-1], []).append(row)
+    return rows_by_note
+
+
+# Regroupe les commandes en attente sur une courte fenêtre (REDSHIFT_BATCH_WINDOW_MS)
+query_batcher = QueryBatcher(fetch_dpe_rows_batch)
+# Les extractions identiques simultanées partagent une seule exécution Redshift
+export_flight = SingleFlight()
+
+REGISTRY.register_collector(lambda: [('dpe_job_queue_depth', 'gauge',
+                                      'Jobs en attente ou en cours', executor.pending_count())])
+REGISTRY.register_collector(stats_collector('redshift_pool', redshift_pool.stats,
+                                            counters={'created', 'closed', 'checkouts', 'timeouts',
+                                                      'ping_failures', 'recycled', 'wait_seconds_total'}))
+REGISTRY.register_collector(stats_collector('dpe_cache', dpe_cache.stats,
+                                            counters={'hits', 'misses', 'evictions', 'expirations'}))
+for bulkhead in (redshift_slots, s3_slots):
+    REGISTRY.register_collector(stats_collector(f'dpe_{bulkhead.name}_slots', bulkhead.stats,
+                                                counters={'acquired', 'rejected', 'wait_seconds_total'}))
+REGISTRY.register_collector(stats_collector('order_state', order_states.stats,
+                                            counters={'claims', 'duplicates', 'waiting', 'cancelled',
+                                                      'cancelled_jobs', 'pruned'}))
+REGISTRY.register_collector(stats_collector('log_queue', logging_stats, counters={'dropped'}))
+if recorder.enabled:
+    REGISTRY.register_collector(stats_collector('webhook_recorder', recorder.stats,
+                                                counters={'recorded', 'dropped', 'rotations', 'errors'}))
+
+
+def start_background():
+    # Préchauffage en arrière-plan pour que la première commande ne paie pas la connexion
+    if dbname and user and os.environ.get('REDSHIFT_POOL_WARMUP', '1') == '1':
+        redshift_pool.start_warmup()
+    # boto3 est importé en arrière-plan plutôt qu'au démarrage ou à la première commande
+    if os.environ.get('S3_WARMUP', '1') == '1':
+        start_s3_warmup()
+    # Avec une file durable, reprise des jobs laissés par un processus précédent. Les
+    # dynos web peuvent laisser l'extraction au process worker (JOB_CONSUMERS=0).
+    if os.environ.get('JOB_CONSUMERS', '1') == '1':
+        executor.start()
+    elif not JOB_QUEUE_URL:
+        logger.warning("JOB_CONSUMERS=0 sans JOB_QUEUE_URL : les jobs restent exécutés en mémoire par le web")
+
+
+def after_fork():
+    # Appelé par gunicorn dans chaque worker quand l'application est préchargée
+    logging_after_fork()
+    redshift_pool.after_fork()
+    executor.after_fork()
+    query_batcher.after_fork()
+    deduplicator.after_fork()
+    order_states.after_fork()
+    redshift_slots.after_fork()
+    s3_slots.after_fork()
+    admission.after_fork()
+    recorder.after_fork()
+    reset_s3_client()
+    start_background()
+
+
+@register_handler
+def get_dpe_data(note_dpe, order_id, limit=None):
+    limit = limit or dpe_limit
+    cache_key = (note_dpe, limit, type_batiment)
+    cached = dpe_cache.get(cache_key)
+    if cached is not None:
+        # Même extrait déjà publié récemment : on réutilise l'objet S3 existant
+        logger.info("Extrait DPE servi depuis le cache pour %s", cache_key)
+        result = presign_cached_result(cached)
+    else:
+        result = export_flight.do(cache_key, lambda: export_and_cache(cache_key, note_dpe, order_id, limit))
+    order_states.complete(order_id)
+    return result
+
+
+def export_and_cache(cache_key, note_dpe, order_id, limit):
+    result = export_dpe_data(note_dpe, order_id, limit)
+    dpe_cache.set(cache_key, result)
+    return result
+
+
+def presign_cached_result(cached):
+    result = dict(cached, cache=True)
+    if 'fichiers' in cached:
+        result['urls'] = [create_presigned_url('data-dpe', key, expiration=3600) for key in cached['fichiers']]
+        result['url'] = result['urls'][0] if result['urls'] else None
+    else:
+        result['url'] = create_presigned_url('data-dpe', cached['fichier'], expiration=3600)
+    return result
+
+
+def export_dpe_data(note_dpe, order_id, limit):
+    # Gros extraits : les noeuds Redshift écrivent directement dans S3
+    if UNLOAD_IAM_ROLE and limit >= unload_threshold:
+        return unload_dpe_data(note_dpe, order_id, limit)
+    if export_mode == 'stream':
+        return stream_dpe_data(note_dpe, order_id, limit)
+    try:
+        logger.debug("Début de requête")
+        with stage('query'):
+            rows = fetch_dpe_rows(note_dpe, limit)
+        ROWS_RETURNED.inc(len(rows))
+        logger.info("Requête terminée, nombre de lignes récupérées : %d", len(rows))
 
+        # Premières lignes pour le débogage, masquées et tronquées par le formatage
+        logger.debug("Premières lignes : %s", rows[:5])
 
-def get_dpe_data(note_dpe, order_id):
-    try:
-        conn = psycopg2.connect(dbname=dbname, user=user, password=password, host='pw-cluster.cq6jh9anojbf.us-west-2.redshift.amazonaws.com', port=5439)
-        print('Début de requête')
-        with conn.cursor() as cursor:
-            query = """
-            SELECT DISTINCT p.n_dpe AS num_dpe, MAX(lastname) AS nom, MAX(firstname) AS prenom,
-            MAX(tel_mobile) AS tel_mobile, MAX(email) AS email, MAX(zipcode) AS code_postal,
-            MAX(etiquette_dpe) AS note_dpe  
-            FROM vw_principale_tel_mobile p
-            LEFT JOIN fact_dpe d ON d.n_dpe = p.n_dpe
-            WHERE type_batiment = 'maison' AND etiquette_dpe = %s
-            GROUP BY p.n_dpe
-            LIMIT 5;  -- Réduire la limite à 5 pour les tests
-            """
-            cursor.execute(query, (note_dpe,))
-            rows = cursor.fetchall()
-            print('Requête terminée, nombre de lignes récupérées :', len(rows))
-
-            # Afficher les premières lignes pour le débogage
-            for row in rows[:5]:  # Limiter l'affichage aux 5 premières lignes
-                print(row)
-
-        conn.close()
         filename = f"dpe_data_{order_id}.csv"
-        write_to_csv(rows, filename)  # Assurez-vous d'utiliser 'rows' au lieu de 'row'
+        with stage('csv_write'):
+            write_to_csv(rows, filename)  # Assurez-vous d'utiliser 'rows' au lieu de 'row'
         bucket_name = "data-dpe"
-        uploaded = upload_to_s3(filename, bucket_name)  # Utiliser 'filename' ici
+        with stage('s3_upload'):
+            uploaded = upload_to_s3(filename, bucket_name)  # Utiliser 'filename' ici
         if uploaded:
-            print(f"Fichier {filename} chargé avec succès dans S3.")
+            logger.info("Fichier %s chargé avec succès dans S3.", filename)
         else:
-            print(f"Échec du chargement du fichier {filename} dans S3.")
-        filename = f"dpe_data_{order_id}.csv"
+            logger.error("Échec du chargement du fichier %s dans S3.", filename)
+            raise RuntimeError(f"Échec du chargement du fichier {filename} dans S3")
         presigned_url = create_presigned_url('data-dpe', filename, expiration=3600)  # URL valide pour 1 heure
-        print(presigned_url)
         #if presigned_url:
         #    # Envoyer l'URL par e-mail à l'acheteur
         #    send_email_with_attachment(customer_email, "Votre fichier DPE", "Veuillez trouver ci-joint le lien pour télécharger votre fichier DPE.", presigned_url)
-        return rows
-                
+        # Résumé conservé dans l'état du job (pas les lignes elles-mêmes)
+        return {'fichier': filename, 'url': presigned_url, 'nb_lignes': len(rows)}
+
     except Exception as e:
-        print(f"Erreur lors de l'exécution de la requête : {e}")
-        return None
+        logger.error("Erreur lors de l'exécution de la requête : %s", e)
+        raise
+
+
+def fetch_dpe_rows(note_dpe, limit):
+    if query_batcher.enabled:
+        return query_batcher.fetch(note_dpe, limit)
+    with redshift_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(DPE_QUERY, (type_batiment, note_dpe, limit))
+        return cursor.fetchall()
+
+
+def stream_dpe_data(note_dpe, order_id, limit):
+    # Les lignes passent par lots du curseur serveur à l'upload S3, sans fichier local
+    filename = f"dpe_data_{order_id}.csv"
+    bucket_name = "data-dpe"
+    s3_client = get_s3_client()
+    upload = MultipartCsvUpload(s3_client, bucket_name, filename, header=CSV_HEADER)
+    try:
+        # Créneau S3 pris avant le créneau Redshift, seul endroit où les deux sont tenus
+        with stage('stream_export'), s3_slots.slot():
+            with redshift_connection() as conn:
+                with conn.cursor(name=f"dpe_export_{uuid.uuid4().hex}") as cursor:
+                    cursor.itersize = stream_fetch_size
+                    cursor.execute(DPE_QUERY, (type_batiment, note_dpe, limit))
+                    while True:
+                        rows = cursor.fetchmany(stream_fetch_size)
+                        if not rows:
+                            break
+                        upload.write_rows(rows)
+            upload.close()
+    except Exception as e:
+        logger.error("Erreur lors de l'export en flux : %s", e)
+        upload.abort()
+        raise
+    ROWS_RETURNED.inc(upload.rows)
+    BYTES_UPLOADED.inc(upload.bytes_uploaded)
+    logger.info("Fichier %s chargé en flux dans S3 (%d lignes, %d octets).", filename, upload.rows, upload.bytes_uploaded)
+    presigned_url = create_presigned_url(bucket_name, filename, expiration=3600)
+    return {'fichier': filename, 'url': presigned_url, 'nb_lignes': upload.rows}
+
+
+def unload_dpe_data(note_dpe, order_id, limit):
+    bucket_name = "data-dpe"
+    prefix = f"unload/dpe_data_{order_id}_"
+    s3_client = get_s3_client()
+    try:
+        with stage('unload'), redshift_connection() as conn:
+            unloaded = unload_to_s3(conn, s3_client, DPE_QUERY, (type_batiment, note_dpe, limit), bucket_name, prefix)
+    except Exception as e:
+        logger.error("Erreur lors de l'UNLOAD : %s", e)
+        raise
+    ROWS_RETURNED.inc(unloaded['nb_lignes'] or 0)
+    urls = [create_presigned_url(bucket_name, key, expiration=3600) for key in unloaded['keys']]
+    return {'fichier': unloaded['manifest'], 'fichiers': unloaded['keys'],
+            'url': urls[0] if urls else None, 'urls': urls, 'nb_lignes': unloaded['nb_lignes']}
 
 
 
 def upload_to_s3(file_name, bucket, object_name=None):
     if object_name is None:
         object_name = file_name
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key
-    )
+    s3_client = get_s3_client()
     try:
-        response = s3_client.upload_file(file_name, bucket, object_name)
+        with s3_slots.slot():
+            response = s3_client.upload_file(file_name, bucket, object_name, Config=get_transfer_config())
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Erreur lors du chargement sur S3 : {e}")
+        logger.error("Erreur lors du chargement sur S3 : %s", e)
         return False
+    BYTES_UPLOADED.inc(os.path.getsize(file_name))
     return True
 
 def create_presigned_url(bucket_name, object_name, expiration=3600):
-    s3_client = boto3.client('s3',
-                             aws_access_key_id=aws_access_key,
-                             aws_secret_access_key=aws_secret_key)
+    s3_client = get_s3_client()
+    # botocore est déjà chargé par get_s3_client()
+    from botocore.exceptions import NoCredentialsError
+
     try:
-        response = s3_client.generate_presigned_url('get_object',
-                                                    Params={'Bucket': bucket_name,
-                                                            'Key': object_name},
-                                                    ExpiresIn=expiration)
+        with stage('presign'):
+            response = s3_client.generate_presigned_url('get_object',
+                                                        Params={'Bucket': bucket_name,
+                                                                'Key': object_name},
+                                                        ExpiresIn=expiration)
     except NoCredentialsError:
-        print("Les identifiants pour accéder à AWS S3 n'ont pas été trouvés.")
+        logger.error("Les identifiants pour accéder à AWS S3 n'ont pas été trouvés.")
         return None
 
     return response
 
 
 
-def verify_woocommerce_signature(request, woocommerce_secret):
-    # Log tous les en-têtes pour le débogage
+def verify_woocommerce_signature(request, webhook_keys):
+    # Renvoie le corps brut si la signature correspond à l'un des secrets actifs de la
+    # boutique émettrice, None sinon. Le corps n'est lu qu'une fois, HMAC calculé au fil des blocs.
     logger.debug("En-têtes reçus : %s", request.headers)
 
     received_signature_base64 = request.headers.get('X-WC-Webhook-Signature')
     if received_signature_base64 is None:
         logger.error("Aucune signature Webhook WooCommerce trouvée dans les en-têtes.")
-        return False
-
-
-    request_payload = request.get_data(as_text=True)
-    logger.debug(f"Corps de la requête pour la génération de la signature: {request_payload}")
-
-    # Décoder la signature reçue de Base64 en bytes
-    received_signature_bytes = base64.b64decode(received_signature_base64)
-    
-    # Générer la signature HMAC en tant que bytes
-    generated_signature_bytes = hmac.new(woocommerce_secret.encode(), request_payload.encode(), hashlib.sha256).digest()
-
-    # Comparaison des signatures en bytes
-    signature_valid = hmac.compare_digest(received_signature_bytes, generated_signature_bytes)
+        return None
 
-    #logger.debug(f"Signature reçue (décodée): {received_signature_bytes}")
-    #logger.debug(f"Signature générée (bytes): {generated_signature_bytes}")
+    source = request.headers.get('X-WC-Webhook-Source') if webhook_keys.per_source else None
+    body, key = webhook_keys.verify(request.stream, received_signature_base64, source)
+    # Conservé pour l'enregistreur : le flux de la requête est désormais consommé
+    g.raw_body = body
+    SIGNATURE_KEYS.inc(key_id=key.key_id if key is not None else 'aucune')
+    if key is None:
+        return None
+    if key.previous:
+        logger.info("Livraison signée avec l'ancien secret (%s)", key.key_id)
+    return body
+
+def extract_note_dpe(order_data):
+    # La note DPE est le suffixe du nom d'article, ex. "Fichier leads DPE - G"
+    for item in order_data.get('line_items', []):
+        item_name = item.get('name', '')
+        if '-' in item_name:
+            return item_name.split('-')[-1].strip()
+    return None
+
+
+def extract_row_limit(order_data):
+    # Lignes demandées par la commande : quantité de l'article DPE × lignes par article
+    for item in order_data.get('line_items', []):
+        if '-' in item.get('name', ''):
+            try:
+                quantity = int(item.get('quantity') or 1)
+            except (TypeError, ValueError):
+                quantity = 1
+            return max(quantity, 1) * dpe_limit
+    return dpe_limit
 
-    return signature_valid
 
 def write_to_csv(data, filename):
     with open(filename, 'w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(['num_dpe', 'nom', 'prenom', 'tel_mobile', 'email', 'code_postal', 'note_dpe'])
+        writer.writerow(CSV_HEADER)
         for row in data:
             writer.writerow(row)
 
 
 
+topic_router = TopicRouter()
+
+
 @app.route('/wcwebhook', methods=['POST'])
 def webhook():
-    if woocommerce_secret is None:
+    # Aiguillage sur les en-têtes seuls, avant de lire le corps : le ping envoyé par
+    # WooCommerce à la création du webhook (sans sujet) et les sujets sans traitement
+    # sont acquittés sans vérification ni analyse, puisqu'ils ne déclenchent rien.
+    topic = request.headers.get('X-WC-Webhook-Topic')
+    if topic is None:
+        WEBHOOK_TOPICS.inc(topic='ping', route='ping')
+        return 'Ping reçu', 200
+    handler = topic_router.lookup(topic, request.headers.get('X-WC-Webhook-Resource'))
+    if handler is None:
+        WEBHOOK_TOPICS.inc(topic='autre', route='ignore')
+        logger.debug("Sujet %s sans traitement, livraison ignorée", topic)
+        return 'Sujet ignoré', 200
+    WEBHOOK_TOPICS.inc(topic=topic, route=handler.__name__)
+
+    if not webhook_keys:
         logger.error("La clé secrète WooCommerce n'est pas définie.")
         return 'Erreur de configuration du serveur', 500
 
-    if not verify_woocommerce_signature(request, woocommerce_secret):
+    try:
+        with stage('signature'):
+            body = verify_woocommerce_signature(request, webhook_keys)
+    except PayloadTooLarge as e:
+        logger.error("Livraison de %s octets refusée (limite %s)", e, WEBHOOK_MAX_BYTES)
+        return 'Livraison trop volumineuse', 413
+    # Rejet avant toute analyse du JSON
+    if body is None:
         logger.error("Signature non valide ou manquante dans la requête.")
         return 'Signature non valide', 403
 
-    try:
-        order_data = request.json
-        order_id = order_data.get('id')  # Récupération de l'ID de la commande
-        customer_email = order_data.get('billing', {}).get('email')  # Récupération de l'email du client
-        print(customer_email)
-        items = order_data.get('line_items', [])
-        note_dpe_from_order = None
-
-        for item in items:
-            item_name = item.get('name', '')
-            if '-' in item_name:
-                note_dpe_from_order = item_name.split('-')[-1].strip()
-                break
-
-        if note_dpe_from_order:
-            logger.info(f"Note DPE extraite de la commande : {note_dpe_from_order}")
-            dpe_data = get_dpe_data(note_dpe_from_order, order_id)
-            logger.info(f"Données DPE récupérées : {dpe_data}")
-            if customer_email:
-                logger.info(f"Email du client : {customer_email}")
-                # Vous pouvez stocker ou traiter l'email ici
-            else:
-                logger.warning("Aucun email de client trouvé dans la commande.")
-        else:
-            logger.error("Aucune note DPE trouvée dans les articles de la commande.")
+    # Relivraison WooCommerce : on renvoie l'état du job existant sans rien relancer
+    delivery_id = request.headers.get('X-WC-Webhook-Delivery-ID')
+    existing_job_id = deduplicator.find(dedup_keys(delivery_id=delivery_id), executor.is_live)
+    if existing_job_id is not None:
+        return duplicate_response(existing_job_id)
+
+    if not admission.admit():
+        logger.warning("File de jobs pleine, livraison refusée")
+        return overloaded_response()
 
-        return 'Webhook traité avec succès', 200
+    try:
+        with stage('json_parse'):
+            data = json.loads(body)
+        return handler(data, delivery_id)
     except Exception as e:
         logger.exception("Erreur lors du traitement du webhook: %s", e)
         return 'Erreur interne du serveur', 500
 
 
-    
+def can_retry(job_id, age):
+    # Une extraction échouée, annulée, ou perdue peut être relancée par une nouvelle
+    # livraison. Un job inconnu de l'exécuteur est perdu (redémarrage ou recyclage du
+    # worker avant son exécution) une fois passé le court délai entre réservation et
+    # mise en file. Une extraction terminée est marquée dans order_state et n'arrive pas ici.
+    job = executor.get(job_id)
+    if job is None:
+        return age >= ORDER_LOST_JOB_GRACE
+    return job['status'] in (FAILED, DEAD, CANCELLED)
+
+
+@topic_router.register(*order_topics)
+def handle_order(order_data, delivery_id):
+    order_id = order_data.get('id')  # Récupération de l'ID de la commande
+    order_status = order_data.get('status')
+    decision = order_rules.evaluate(order_data)
+    ORDER_DECISIONS.inc(decision=decision)
+    if decision == CANCEL:
+        job_id, dropped = order_states.cancel(order_id, order_status, executor.cancel)
+        if dropped:
+            logger.info("Commande %s annulée (%s), job %s retiré de la file", order_id, order_status, job_id)
+        return 'Commande annulée', 200
+    if decision == WAIT:
+        # Commande en attente de paiement : elle sera traitée à la livraison qui la passe en payée
+        order_states.wait(order_id, order_status)
+        logger.info("Commande %s au statut %s, extraction différée", order_id, order_status)
+        return 'Commande non payée, extraction différée', 200
+
+    customer_email = order_data.get('billing', {}).get('email')  # Récupération de l'email du client
+    note_dpe_from_order = extract_note_dpe(order_data)
+
+    if note_dpe_from_order:
+        logger.info("Note DPE extraite de la commande : %s", note_dpe_from_order, extra={'order_id': order_id})
+        if customer_email:
+            logger.info("Email du client : %s", customer_email, extra={'order_id': order_id})
+            # Vous pouvez stocker ou traiter l'email ici
+        else:
+            logger.warning("Aucun email de client trouvé dans la commande.")
+        job_id = uuid.uuid4().hex
+        keys = dedup_keys(delivery_id, order_id)
+        existing_job_id = deduplicator.claim(keys, job_id, executor.is_live)
+        if existing_job_id is not None:
+            return duplicate_response(existing_job_id)
+        claimed = False
+        try:
+            existing_job_id = order_states.claim(order_id, order_status, job_id, can_retry)
+            if existing_job_id is not None:
+                # job_id ne sera jamais soumis : les clés de déduplication suivent le job existant
+                deduplicator.assign(keys, existing_job_id)
+                return duplicate_response(existing_job_id)
+            claimed = True
+            # L'extraction tourne hors du thread de requête : on acquitte tout de suite
+            limit = extract_row_limit(order_data)
+            job = executor.submit(get_dpe_data, note_dpe_from_order, order_id, limit, job_id=job_id,
+                                  order_id=order_id, note_dpe=note_dpe_from_order, limit=limit)
+        except Exception:
+            # Job jamais soumis (file indisponible...) : on libère les réservations pour
+            # que la relivraison de WooCommerce, après la 500, relance l'extraction
+            if claimed:
+                order_states.release(order_id, job_id)
+            deduplicator.release(keys, job_id)
+            raise
+        return jsonify(job), 202
+    else:
+        logger.error("Aucune note DPE trouvée dans les articles de la commande.")
+
+    return 'Webhook traité avec succès', 200
+
+
+def overloaded_response():
+    # WooCommerce relivre plus tard ; Retry-After indique le délai conseillé
+    response = Response('Service temporairement surchargé', status=503)
+    response.headers['Retry-After'] = str(admission.retry_after)
+    return response
+
+
+def duplicate_response(job_id):
+    logger.info("Livraison en double ignorée, job existant %s", job_id)
+    job = executor.get(job_id) or {'id': job_id}
+    return jsonify(job), 200
+
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = executor.get(job_id)
+    if job is None:
+        return 'Job inconnu', 404
+    return jsonify(job), 200
+
+
+@app.route('/stats/redshift', methods=['GET'])
+def redshift_pool_stats():
+    return jsonify(redshift_pool.stats()), 200
+
+
+@app.route('/stats/cache', methods=['GET'])
+def dpe_cache_stats():
+    stats = dpe_cache.stats()
+    stats['single_flight'] = export_flight.stats()
+    stats['batching'] = query_batcher.stats()
+    return jsonify(stats), 200
+
+
+@app.route('/orders/<order_id>', methods=['GET'])
+def order_status(order_id):
+    state = order_states.get(order_id)
+    if state is None:
+        return 'Commande inconnue', 404
+    return jsonify(state), 200
+
+
+@app.route('/stats/dedup', methods=['GET'])
+def dedup_stats():
+    return jsonify(deduplicator.stats()), 200
+
+
+@app.route('/stats/admission', methods=['GET'])
+def admission_stats():
+    return jsonify({'webhook': admission.stats(), 'redshift': redshift_slots.stats(),
+                    's3': s3_slots.stats()}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.after_request
+def count_webhook_response(response):
+    if request.path == '/wcwebhook':
+        REQUESTS.inc(code=response.status_code)
+    return response
+
+
 @app.route('/')
 def home():
     return "hello world"
 
+# Démarré en fin de module pour que les handlers de jobs soient enregistrés. Avec
+# gunicorn --preload, les threads d'arrière-plan sont démarrés par chaque worker après le fork.
+if os.environ.get('WSGI_PRELOAD') != '1':
+    start_background()
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    # Serveur de développement uniquement ; en production le Procfile lance gunicorn
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '8080')),
+            debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,93 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# Fenêtre de regroupement (0 = désactivé), taille max d'un lot et lots exécutés en parallèle
+BATCH_WINDOW_MS = float(os.environ.get('REDSHIFT_BATCH_WINDOW_MS', '0'))
+BATCH_MAX_ORDERS = int(os.environ.get('REDSHIFT_BATCH_MAX_ORDERS', '100'))
+BATCH_CONCURRENCY = int(os.environ.get('REDSHIFT_BATCH_CONCURRENCY', '2'))
+
+
+class QueryBatcher:
+    def __init__(self, execute_batch, window_ms=BATCH_WINDOW_MS, max_orders=BATCH_MAX_ORDERS,
+                 concurrency=BATCH_CONCURRENCY):
+        # execute_batch(notes, limit) -> {note: [lignes]} pour une seule requête Redshift
+        self.execute_batch = execute_batch
+        self.window = window_ms / 1000.0
+        self.max_orders = max_orders
+        self.concurrency = concurrency
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._runner = None
+        self._stats = {'batches': 0, 'orders': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._runner = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                  thread_name_prefix='redshift-batch')
+                self._thread = threading.Thread(target=self._collect, name='redshift-batcher', daemon=True)
+                self._thread.start()
+
+    def after_fork(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._runner = None
+
+    def fetch(self, note_dpe, limit):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((note_dpe, limit, future))
+        return future.result()
+
+    def _collect(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(pending) < self.max_orders:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._runner.submit(self._run_batch, pending)
+
+    def _run_batch(self, pending):
+        notes = sorted({note for note, _, _ in pending})
+        limit = max(limit for _, limit, _ in pending)
+        try:
+            rows_by_note = self.execute_batch(notes, limit)
+        except Exception as e:
+            logger.exception("Échec de la requête groupée pour %s : %s", notes, e)
+            with self._lock:
+                self._stats['errors'] += 1
+            for _, _, future in pending:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['orders'] += len(pending)
+        logger.info("Requête groupée : %d commande(s), notes %s", len(pending), notes)
+        # Chaque commande reçoit sa tranche des lignes numérotées de sa note
+        for note, order_limit, future in pending:
+            future.set_result(rows_by_note.get(note, [])[:order_limit])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
@@ -0,0 +1,83 @@
+import re
+import sqlite3
+
+
+# Remplaçant SQLite de Redshift pour les benchmarks : expose le sous-ensemble de
+# l'API psycopg2 utilisé par app.py (curseurs nommés, fetchmany, paramètres %s).
+
+# DDL commun à SQLite et Postgres ; les index sont créés après le chargement en masse
+TABLES = """
+CREATE TABLE IF NOT EXISTS vw_principale_tel_mobile (
+    n_dpe TEXT, lastname TEXT, firstname TEXT, tel_mobile TEXT, email TEXT, zipcode TEXT
+);
+CREATE TABLE IF NOT EXISTS fact_dpe (
+    n_dpe TEXT, etiquette_dpe TEXT, type_batiment TEXT
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_fact_dpe_etiquette ON fact_dpe (etiquette_dpe, type_batiment, n_dpe);
+CREATE INDEX IF NOT EXISTS idx_vw_n_dpe ON vw_principale_tel_mobile (n_dpe);
+"""
+
+_PLACEHOLDER = re.compile(r'%s')
+
+
+def _translate(query, params):
+    # %s -> ? ; un tuple (IN %s) est déplié en (?, ?, ...) comme le fait psycopg2
+    params = list(params or ())
+    flat = []
+    index = iter(range(len(params)))
+
+    def replace(_):
+        value = params[next(index)]
+        if isinstance(value, tuple):
+            flat.extend(value)
+            return '(' + ', '.join('?' * len(value)) + ')'
+        flat.append(value)
+        return '?'
+
+    return _PLACEHOLDER.sub(replace, query), flat
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+        self.itersize = 2000
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def execute(self, query, params=None):
+        self._cursor.execute(*_translate(query, params))
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+
+class FakeConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self.closed = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+        self.closed = 1
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+# S3 minimal en mémoire pour les benchmarks hors ligne : PutObject, GetObject et
+# upload multipart, en adressage par chemin (http://hote:port/bucket/cle).
+
+class FakeS3Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.uploads = {}
+        self.bytes_received = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    store = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _target(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = parts.path.lstrip('/').partition('/')
+        return bucket, key, parse_qs(parts.query, keep_blank_values=True)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _reply(self, status=200, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_PUT(self):
+        bucket, key, query = self._target()
+        data = self._body()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        with self.store.lock:
+            self.store.bytes_received += len(data)
+            if 'uploadId' in query:
+                upload = self.store.uploads.get(query['uploadId'][0])
+                if upload is None:
+                    return self._reply(404)
+                upload[int(query['partNumber'][0])] = data
+            else:
+                self.store.objects[(bucket, key)] = data
+        self._reply(200, headers={'ETag': etag})
+
+    def do_POST(self):
+        bucket, key, query = self._target()
+        self._body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.uploads[upload_id] = {}
+            body = ('<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult>'
+                    f'<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>'
+                    '</InitiateMultipartUploadResult>').encode()
+            return self._reply(200, body, {'Content-Type': 'application/xml'})
+        if 'uploadId' in query:
+            with self.store.lock:
+                parts = self.store.uploads.pop(query['uploadId'][0], None)
+                if parts is None:
+                    return self._reply(404)
+                self.store.objects[(bucket, key)] = b''.join(parts[n] for n in sorted(parts))
+            body = ('<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult>'
+                    f'<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>"fake"</ETag>'
+                    '</CompleteMultipartUploadResult>').encode()
+            return self._reply(200, body, {'Content-Type': 'application/xml'})
+        self._reply(400)
+
+    def do_GET(self):
+        bucket, key, _ = self._target()
+        with self.store.lock:
+            data = self.store.objects.get((bucket, key))
+        if data is None:
+            return self._reply(404)
+        self._reply(200, data, {'ETag': '"%s"' % hashlib.md5(data).hexdigest()})
+
+    def do_DELETE(self):
+        bucket, key, query = self._target()
+        with self.store.lock:
+            if 'uploadId' in query:
+                self.store.uploads.pop(query['uploadId'][0], None)
+            else:
+                self.store.objects.pop((bucket, key), None)
+        self._reply(204)
+
+
+def start_fake_s3(host='127.0.0.1', port=0):
+    store = FakeS3Store()
+    handler = type('FakeS3Handler', (_Handler,), {'store': store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='fake-s3', daemon=True)
+    thread.start()
+    endpoint = f"http://{host}:{server.server_address[1]}"
+    return server, store, endpoint
@@ -0,0 +1,206 @@
+"""Génère un jeu de leads DPE synthétique et reproductible pour les benchmarks.
+
+Exemples :
+    python -m bench.generate_dataset --rows 1000000 --sqlite /tmp/dpe.sqlite
+    python -m bench.generate_dataset --rows 20000000 --dsn postgresql://localhost/dpe
+
+--rows est le nombre de DPE distincts (lignes de fact_dpe). vw_principale_tel_mobile
+contient en plus des doublons de n_dpe (plusieurs contacts pour un même logement),
+dans la proportion --duplicate-rate. Les étiquettes suivent la répartition observée
+du parc français, les codes postaux sont tirés au prorata de la population des
+départements.
+
+Les tables sont (re)créées à chaque génération : une cible qui contient déjà des
+lignes est refusée sauf avec --force, qui la remplace.
+"""
+import argparse
+import bisect
+import io
+import itertools
+import random
+import sqlite3
+import sys
+import time
+
+from bench.fake_db import INDEXES, TABLES
+
+
+TABLE_NAMES = ('vw_principale_tel_mobile', 'fact_dpe')
+DROP_TABLES = ''.join(f'DROP TABLE IF EXISTS {name};\n' for name in TABLE_NAMES)
+
+
+class TargetNotEmpty(Exception):
+    pass
+
+
+# Répartition approximative des étiquettes DPE du parc de logements
+LABEL_WEIGHTS = {'A': 0.02, 'B': 0.03, 'C': 0.13, 'D': 0.31, 'E': 0.27, 'F': 0.14, 'G': 0.10}
+BUILDING_WEIGHTS = {'maison': 0.56, 'appartement': 0.44}
+
+# Population des départements en millions (métropole), pour pondérer les codes postaux
+DEPARTMENT_POPULATION = {
+    '01': 0.66, '02': 0.53, '03': 0.33, '04': 0.17, '05': 0.14, '06': 1.10, '07': 0.33,
+    '08': 0.27, '09': 0.15, '10': 0.31, '11': 0.38, '12': 0.28, '13': 2.04, '14': 0.70,
+    '15': 0.14, '16': 0.35, '17': 0.66, '18': 0.30, '19': 0.24, '20': 0.35, '21': 0.54,
+    '22': 0.60, '23': 0.12, '24': 0.41, '25': 0.54, '26': 0.52, '27': 0.60, '28': 0.43,
+    '29': 0.92, '30': 0.75, '31': 1.42, '32': 0.19, '33': 1.66, '34': 1.20, '35': 1.10,
+    '36': 0.22, '37': 0.61, '38': 1.28, '39': 0.26, '40': 0.42, '41': 0.33, '42': 0.77,
+    '43': 0.23, '44': 1.45, '45': 0.68, '46': 0.17, '47': 0.33, '48': 0.08, '49': 0.82,
+    '50': 0.50, '51': 0.57, '52': 0.17, '53': 0.31, '54': 0.73, '55': 0.18, '56': 0.76,
+    '57': 1.05, '58': 0.20, '59': 2.61, '60': 0.83, '61': 0.28, '62': 1.47, '63': 0.66,
+    '64': 0.69, '65': 0.23, '66': 0.48, '67': 1.15, '68': 0.77, '69': 1.88, '70': 0.23,
+    '71': 0.55, '72': 0.57, '73': 0.44, '74': 0.83, '75': 2.15, '76': 1.25, '77': 1.42,
+    '78': 1.45, '79': 0.37, '80': 0.57, '81': 0.39, '82': 0.26, '83': 1.08, '84': 0.56,
+    '85': 0.69, '86': 0.44, '87': 0.37, '88': 0.36, '89': 0.33, '90': 0.14, '91': 1.30,
+    '92': 1.62, '93': 1.66, '94': 1.41, '95': 1.25,
+}
+
+LAST_NAMES = ('MARTIN', 'BERNARD', 'THOMAS', 'PETIT', 'ROBERT', 'RICHARD', 'DURAND', 'DUBOIS',
+              'MOREAU', 'LAURENT', 'SIMON', 'MICHEL', 'LEFEBVRE', 'LEROY', 'ROUX', 'DAVID',
+              'BERTRAND', 'MOREL', 'FOURNIER', 'GIRARD', 'BONNET', 'DUPONT', 'LAMBERT', 'FONTAINE',
+              'ROUSSEAU', 'VINCENT', 'MULLER', 'LEFEVRE', 'FAURE', 'ANDRE', 'MERCIER', 'BLANC')
+FIRST_NAMES = ('Marie', 'Jean', 'Pierre', 'Michel', 'Nathalie', 'Isabelle', 'Philippe', 'Catherine',
+               'Alain', 'Sylvie', 'Nicolas', 'Christophe', 'Sandrine', 'Patrick', 'Valérie', 'Julien',
+               'Stéphanie', 'Laurent', 'Céline', 'Thomas', 'Camille', 'Léa', 'Lucas', 'Manon')
+EMAIL_DOMAINS = ('gmail.com', 'orange.fr', 'hotmail.fr', 'free.fr', 'sfr.fr', 'laposte.net', 'yahoo.fr')
+
+
+def _sampler(weights):
+    # Tirage pondéré en O(log n) par bisection sur les poids cumulés
+    values = list(weights)
+    cumulative = list(itertools.accumulate(weights[value] for value in values))
+    total = cumulative[-1]
+
+    def sample(rng):
+        return values[bisect.bisect_right(cumulative, rng.random() * total)]
+    return sample
+
+
+def generate(rows, seed=0, duplicate_rate=0.15, batch_size=100000):
+    """Produit des lots (contacts, dpe) prêts à insérer, de façon déterministe pour une graine donnée."""
+    rng = random.Random(seed)
+    label = _sampler(LABEL_WEIGHTS)
+    building = _sampler(BUILDING_WEIGHTS)
+    department = _sampler(DEPARTMENT_POPULATION)
+    people, facts = [], []
+    for i in range(rows):
+        # Numéro DPE ADEME : 13 caractères, année + département + séquence
+        dept = department(rng)
+        n_dpe = f"{rng.randrange(21, 25)}{dept}E{i:08d}"
+        facts.append((n_dpe, label(rng), building(rng)))
+        contacts = 1
+        while rng.random() < duplicate_rate and contacts < 4:
+            contacts += 1
+        for _ in range(contacts):
+            last, first = rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES)
+            zipcode = f"{dept}{rng.randrange(0, 1000):03d}"
+            people.append((n_dpe, last, first, f"0{rng.choice('67')}{rng.randrange(10 ** 8):08d}",
+                           f"{first.lower()}.{last.lower()}{rng.randrange(1000)}@{rng.choice(EMAIL_DOMAINS)}",
+                           zipcode))
+        if len(facts) >= batch_size:
+            yield people, facts
+            people, facts = [], []
+    if facts:
+        yield people, facts
+
+
+def _check_empty(cursor, existing, force):
+    # Ajouter à un jeu existant doublerait les lignes : on le remplace, ou on refuse
+    for name in existing:
+        cursor.execute(f'SELECT COUNT(*) FROM {name}')
+        count = cursor.fetchone()[0]
+        if count and not force:
+            raise TargetNotEmpty(f"{name} contient déjà {count} lignes (--force pour le remplacer)")
+
+
+def load_sqlite(path, rows, seed=0, duplicate_rate=0.15, batch_size=100000, force=False):
+    conn = sqlite3.connect(path)
+    existing = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)", TABLE_NAMES)]
+    try:
+        _check_empty(conn.cursor(), existing, force)
+    except TargetNotEmpty:
+        conn.close()
+        raise
+    # Chargement en masse : pas de journal ni de fsync, index créés à la fin
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.executescript(DROP_TABLES + TABLES)
+    counts = [0, 0]
+    for people, facts in generate(rows, seed, duplicate_rate, batch_size):
+        conn.executemany('INSERT INTO vw_principale_tel_mobile VALUES (?, ?, ?, ?, ?, ?)', people)
+        conn.executemany('INSERT INTO fact_dpe VALUES (?, ?, ?)', facts)
+        counts[0] += len(people)
+        counts[1] += len(facts)
+    conn.commit()
+    conn.executescript(INDEXES)
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return {'vw_principale_tel_mobile': counts[0], 'fact_dpe': counts[1]}
+
+
+def _copy_buffer(batch):
+    buffer = io.StringIO()
+    for row in batch:
+        buffer.write('\t'.join(row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def load_postgres(dsn, rows, seed=0, duplicate_rate=0.15, batch_size=100000, force=False):
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    counts = [0, 0]
+    with conn, conn.cursor() as cursor:
+        cursor.execute('SELECT table_name FROM information_schema.tables '
+                       'WHERE table_schema = current_schema() AND table_name IN %s', (TABLE_NAMES,))
+        _check_empty(cursor, [row[0] for row in cursor.fetchall()], force)
+        cursor.execute(DROP_TABLES + TABLES)
+        # COPY en texte, un lot à la fois : mémoire bornée quelle que soit la taille du jeu
+        for people, facts in generate(rows, seed, duplicate_rate, batch_size):
+            cursor.copy_expert('COPY vw_principale_tel_mobile FROM STDIN', _copy_buffer(people))
+            cursor.copy_expert('COPY fact_dpe FROM STDIN', _copy_buffer(facts))
+            counts[0] += len(people)
+            counts[1] += len(facts)
+        cursor.execute(INDEXES)
+        cursor.execute('ANALYZE vw_principale_tel_mobile')
+        cursor.execute('ANALYZE fact_dpe')
+    conn.close()
+    return {'vw_principale_tel_mobile': counts[0], 'fact_dpe': counts[1]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='nombre de DPE distincts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duplicate-rate', type=float, default=0.15,
+                        help='probabilité d\'un contact supplémentaire pour un même n_dpe')
+    parser.add_argument('--batch-size', type=int, default=100000)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--sqlite', help='fichier SQLite à créer')
+    target.add_argument('--dsn', help='DSN Postgres')
+    parser.add_argument('--force', action='store_true', help='remplace un jeu existant')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        if args.sqlite:
+            counts = load_sqlite(args.sqlite, args.rows, args.seed, args.duplicate_rate, args.batch_size,
+                                 force=args.force)
+        else:
+            counts = load_postgres(args.dsn, args.rows, args.seed, args.duplicate_rate, args.batch_size,
+                                   force=args.force)
+    except TargetNotEmpty as e:
+        sys.stderr.write(f"Cible non vide : {e}\n")
+        return 1
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    sys.stderr.write(f"{total} lignes chargées en {elapsed:.1f}s ({total / elapsed:.0f} lignes/s) : {counts}\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
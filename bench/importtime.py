@@ -0,0 +1,137 @@
+"""Rapport du temps d'import de l'application, pour suivre le démarrage à froid.
+
+Exemples :
+    python -m bench.importtime                       # rapport et comparaison à la référence
+    python -m bench.importtime --save-baseline
+    python -m bench.importtime --module worker --top 30
+
+Lance --repeats fois `python -X importtime -c "import <module>"` dans un processus
+neuf, avec le préchauffage en arrière-plan désactivé, et agrège les temps par module
+(médiane des répétitions). Les modules de premier niveau sont ceux importés
+directement par le module mesuré ; --top limite le détail aux plus coûteux.
+Le code de sortie vaut 1 si le temps total dépasse la référence de plus de --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+
+from bench.load import BENCH_SECRET, REPO_ROOT
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'importtime.json')
+
+# "import time:  self [us] | cumulative | imported package", l'indentation donne la profondeur
+_LINE = re.compile(r'^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|(?P<indent> *)(?P<name>\S+)$')
+
+# Modules dont le coût est suivi même s'ils sont importés indirectement
+WATCHED = ('boto3', 'botocore', 'psycopg2', 'flask', 'werkzeug', 'jinja2')
+
+
+def parse_importtime(text):
+    # -> [(module, profondeur, self_us, cumulative_us)] dans l'ordre d'apparition
+    entries = []
+    for line in text.splitlines():
+        match = _LINE.match(line)
+        if match:
+            depth = (len(match['indent']) - 1) // 2
+            entries.append((match['name'], depth, int(match['self']), int(match['cumulative'])))
+    return entries
+
+
+def measure_once(module):
+    env = dict(os.environ)
+    env.setdefault('WC_KEY', BENCH_SECRET)
+    # On mesure l'import seul, sans les threads de préchauffage
+    env.update({'REDSHIFT_POOL_WARMUP': '0', 'S3_WARMUP': '0', 'JOB_CONSUMERS': '0',
+                'ORDER_STATE_DB_PATH': ':memory:'})
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True)
+    entries = parse_importtime(completed.stderr)
+    root = next(entry for entry in reversed(entries) if entry[0] == module and entry[1] == 0)
+    # Les imports de premier niveau du module mesuré sont listés juste avant lui, à profondeur 1
+    index = entries.index(root)
+    direct = {}
+    for name, depth, _, cumulative in reversed(entries[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct[name] = cumulative
+    watched = {}
+    for name, _, _, cumulative in entries:
+        if name in WATCHED:
+            watched[name] = cumulative
+    return {'total': root[3], 'self': root[2], 'direct': direct, 'watched': watched}
+
+
+def _median_by_key(runs, field):
+    names = set().union(*(run[field] for run in runs))
+    return {name: statistics.median(run[field].get(name, 0) for run in runs) for name in names}
+
+
+def measure(module, repeats):
+    runs = [measure_once(module) for _ in range(repeats)]
+    totals = [run['total'] for run in runs]
+    return {
+        'total_ms': statistics.median(totals) / 1000,
+        'min_ms': min(totals) / 1000,
+        'self_ms': statistics.median(run['self'] for run in runs) / 1000,
+        'direct_ms': {name: us / 1000 for name, us in _median_by_key(runs, 'direct').items()},
+        'watched_ms': {name: us / 1000 for name, us in _median_by_key(runs, 'watched').items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app', help='module dont on mesure l\'import')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='nombre d\'imports directs détaillés')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='dérive tolérée sur le temps total')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--output', help='fichier JSON de résultats (sinon sortie standard)')
+    args = parser.parse_args(argv)
+
+    result = measure(args.module, args.repeats)
+    direct = sorted(result['direct_ms'].items(), key=lambda item: item[1], reverse=True)
+    result['direct_ms'] = dict(direct[:args.top])
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'module': args.module,
+        'results': result,
+    }
+
+    regression = None
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            file.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('module') == args.module:
+            reference = baseline['results']['total_ms']
+            ratio = result['total_ms'] / reference if reference else None
+            report['baseline_total_ms'] = reference
+            report['ratio'] = ratio
+            if ratio is not None and ratio > 1 + args.tolerance:
+                regression = ratio
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+    if regression is not None:
+        sys.stderr.write(f"Régression : import de {args.module} {regression:.2f}x plus lent que la référence\n")
+    return 1 if regression is not None else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
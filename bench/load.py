@@ -0,0 +1,251 @@
+"""Benchmark de bout en bout de /wcwebhook, entièrement hors ligne.
+
+Exemple :
+    python -m bench.load --requests 500 --concurrency 32 --rows 50000 --output resultats.json
+
+Par défaut l'application est chargée dans le processus (client de test Flask), avec un
+S3 local (bench.fake_s3) et un remplaçant SQLite de Redshift (bench.fake_db). Avec
+--dsn, les requêtes partent vers un Postgres local ; avec --url, la charge est envoyée
+en HTTP à une instance déjà démarrée.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.stats import histogram_quantiles, parse_prometheus, summarize
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_SECRET = 'bench-secret'
+NOTES = 'ABCDEFG'
+# Statuts finaux des deux exécuteurs (jobs.py) : en mémoire et file durable
+TERMINAL = ('done', 'failed', 'dead', 'cancelled')
+
+
+def build_order(order_id, note, rng):
+    return {
+        'id': order_id,
+        'status': 'processing',
+        'date_paid': '2024-01-01T10:00:00',
+        'billing': {'email': f'client{order_id}@example.com'},
+        'line_items': [{'name': f'Fichier leads DPE - {note}', 'quantity': 1,
+                        'total': str(rng.randrange(50, 500))}],
+    }
+
+
+def sign(body, secret):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def delivery_headers(body, secret, delivery_id, topic='order.created'):
+    return {
+        'Content-Type': 'application/json',
+        'X-WC-Webhook-Signature': sign(body, secret),
+        'X-WC-Webhook-Topic': topic,
+        'X-WC-Webhook-Resource': 'order',
+        'X-WC-Webhook-Event': topic.split('.')[-1],
+        'X-WC-Webhook-Delivery-ID': str(delivery_id),
+        'X-WC-Webhook-Source': 'https://boutique.example.com/',
+    }
+
+
+class InProcessTarget:
+    def __init__(self, app_module):
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def post(self, path, body, headers):
+        response = self._client().post(path, data=body, headers=headers)
+        return response.status_code, response.get_data()
+
+    def get(self, path):
+        response = self._client().get(path)
+        return response.status_code, response.get_data()
+
+
+class HttpTarget:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def _open(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post(self, path, body, headers):
+        return self._open(urllib.request.Request(self.base_url + path, data=body, headers=headers, method='POST'))
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.base_url + path))
+
+
+def setup_in_process(args, workdir):
+    # La configuration de l'application est lue à l'import : on prépare l'environnement avant
+    from bench import fake_db
+    from bench.generate_dataset import load_sqlite
+    from bench.fake_s3 import start_fake_s3
+
+    _, s3_store, endpoint = start_fake_s3()
+    os.environ.update({
+        'WC_KEY': args.secret,
+        'S3_ENDPOINT_URL': endpoint,
+        'AWS_ACCESS_KEY': 'bench',
+        'AWS_SECRET_KEY': 'bench',
+        'REDSHIFT_POOL_WARMUP': '0',
+        # Table neuve à chaque run : les mêmes commandes doivent être extraites à nouveau
+        'ORDER_STATE_DB_PATH': os.path.join(workdir, 'order_state.db'),
+    })
+    for item in args.env:
+        key, _, value = item.partition('=')
+        os.environ[key] = value
+
+    if args.dsn:
+        import psycopg2
+        connect = lambda: psycopg2.connect(args.dsn)
+    else:
+        db_path = args.sqlite or os.path.join(workdir, 'dpe.sqlite')
+        if not args.sqlite:
+            load_sqlite(db_path, args.rows, seed=args.seed)
+        connect = lambda: fake_db.FakeConnection(db_path)
+
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    from redshift_pool import ConnectionPool
+    logging.getLogger().setLevel(logging.WARNING)
+    app_module.redshift_pool = ConnectionPool(connect)
+    return app_module, s3_store
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='dpe-bench-')
+    # write_to_csv écrit dans le répertoire courant
+    os.chdir(workdir)
+    s3_store = None
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        app_module, s3_store = setup_in_process(args, workdir)
+        target = InProcessTarget(app_module)
+
+    rng = random.Random(args.seed)
+    order_ids = itertools.count(args.first_order_id)
+    lock = threading.Lock()
+    ack_latencies, job_latencies, codes = [], [], {}
+    job_statuses = {}
+
+    def one_delivery(_):
+        with lock:
+            order_id = next(order_ids)
+            note = rng.choice(NOTES)
+        body = json.dumps(build_order(order_id, note, rng)).encode()
+        headers = delivery_headers(body, args.secret, f'{args.seed}-{order_id}')
+        start = time.perf_counter()
+        status, payload = target.post('/wcwebhook', body, headers)
+        acked = time.perf_counter()
+        job_status = None
+        if status == 202 and args.wait_jobs:
+            job_id = json.loads(payload)['id']
+            deadline = acked + args.job_timeout
+            while time.perf_counter() < deadline:
+                _, job_payload = target.get(f'/jobs/{job_id}')
+                job_status = json.loads(job_payload).get('status')
+                if job_status in TERMINAL:
+                    break
+                time.sleep(args.poll_interval)
+        finished = time.perf_counter()
+        with lock:
+            ack_latencies.append(acked - start)
+            codes[status] = codes.get(status, 0) + 1
+            if job_status is not None:
+                job_statuses[job_status] = job_statuses.get(job_status, 0) + 1
+                if job_status == 'done':
+                    job_latencies.append(finished - start)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one_delivery, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    _, metrics_text = target.get('/metrics')
+    samples = parse_prometheus(metrics_text.decode())
+    return {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rows': None if (args.url or args.dsn or args.sqlite) else args.rows,
+            'backend': 'http' if args.url else ('postgres' if args.dsn else 'sqlite'),
+            'seed': args.seed,
+            'env': args.env,
+        },
+        'elapsed_seconds': elapsed,
+        'throughput': {
+            'deliveries_per_second': args.requests / elapsed if elapsed else None,
+            'jobs_per_second': len(job_latencies) / elapsed if elapsed else None,
+        },
+        'status_codes': {str(code): count for code, count in sorted(codes.items())},
+        'job_statuses': job_statuses,
+        'ack_latency_seconds': summarize(ack_latencies),
+        'job_latency_seconds': summarize(job_latencies),
+        'stage_latency_seconds': histogram_quantiles(samples, 'dpe_stage_seconds', 'stage'),
+        's3_bytes_received': s3_store.bytes_received if s3_store else None,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='nombre de livraisons envoyées')
+    parser.add_argument('--concurrency', type=int, default=16, help='livraisons simultanées')
+    parser.add_argument('--rows', type=int, default=20000, help='DPE distincts du jeu SQLite généré')
+    parser.add_argument('--sqlite', help='base SQLite existante (voir bench.generate_dataset)')
+    parser.add_argument('--dsn', help='DSN d\'un Postgres local à la place de SQLite')
+    parser.add_argument('--url', help='URL d\'une instance déjà démarrée (mode HTTP)')
+    parser.add_argument('--secret', default=BENCH_SECRET, help='clé WooCommerce utilisée pour signer')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--first-order-id', type=int, default=100000)
+    parser.add_argument('--no-wait-jobs', dest='wait_jobs', action='store_false',
+                        help='ne mesurer que l\'acquittement, sans attendre la fin des jobs')
+    parser.add_argument('--job-timeout', type=float, default=60.0)
+    parser.add_argument('--poll-interval', type=float, default=0.005)
+    parser.add_argument('--env', action='append', default=[], metavar='CLE=VALEUR',
+                        help='variable d\'environnement appliquée avant l\'import de app')
+    parser.add_argument('--output', help='fichier JSON de résultats (sinon sortie standard)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.sqlite:
+        args.sqlite = os.path.abspath(args.sqlite)
+    output = os.path.abspath(args.output) if args.output else None
+    results = run(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Micro-benchmarks du chemin de requête, avec comparaison à une référence.
+
+Exemples :
+    python -m bench.micro                                  # mesure et compare à la référence
+    python -m bench.micro --save-baseline                  # met à jour la référence
+    python -m bench.micro --only signature --repeats 20
+    python -m bench.micro --only 'write_to_csv_*'
+
+Chaque cas est préchauffé, puis mesuré sur --repeats répétitions d'un nombre de
+boucles calibré pour durer au moins --min-time secondes. Les durées rapportées sont
+par appel. Le code de sortie vaut 1 si une médiane dépasse la référence de plus de
+--tolerance. --only désigne un cas par son nom exact, ou un motif fnmatch ('*', '?').
+--save-baseline ne remplace dans la référence que les cas mesurés.
+"""
+import argparse
+import fnmatch
+import functools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from bench.load import BENCH_SECRET, REPO_ROOT, build_order, delivery_headers
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json')
+
+
+def _import_app():
+    os.environ.setdefault('WC_KEY', BENCH_SECRET)
+    os.environ.setdefault('AWS_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_SECRET_KEY', 'bench')
+    os.environ.setdefault('REDSHIFT_POOL_WARMUP', '0')
+    os.environ.setdefault('ORDER_STATE_DB_PATH', ':memory:')
+    sys.path.insert(0, REPO_ROOT)
+    import app
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+@functools.lru_cache(maxsize=None)
+def _rows(count):
+    # Construites au premier appel du cas (préchauffage), pas pour les cas écartés par --only
+    return [(f"2169E{i:08d}", 'MARTIN', 'Marie', '0612345678', f'marie.martin{i}@orange.fr', '69003', 'G')
+            for i in range(count)]
+
+
+def build_cases(app, workdir):
+    rng = random.Random(0)
+    body = json.dumps(build_order(123456, 'G', rng)).encode()
+    headers = delivery_headers(body, BENCH_SECRET, 'micro-1')
+
+    def signature():
+        with app.app.test_request_context('/wcwebhook', method='POST', data=body, headers=headers):
+            return app.verify_woocommerce_signature(app.request, app.webhook_keys)
+
+    def parse_and_extract():
+        return app.extract_note_dpe(json.loads(body))
+
+    def presign():
+        return app.create_presigned_url('data-dpe', 'dpe_data_123456.csv', expiration=3600)
+
+    cases = {
+        'signature': signature,
+        'json_parse_extract': parse_and_extract,
+        'presign': presign,
+    }
+    for size in (10, 10000, 1000000):
+        path = os.path.join(workdir, f'csv_{size}.csv')
+        cases[f'write_to_csv_{size}'] = (lambda size=size, path=path: app.write_to_csv(_rows(size), path))
+    return cases
+
+
+def measure(fn, repeats, min_time, warmup):
+    for _ in range(warmup):
+        fn()
+    # Calibration façon timeit.autorange : 1, 2, 5, 10, 20... boucles
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_time:
+            break
+        number = number * 5 // 2 if str(number)[0] == '2' else number * 2
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        'loops': number,
+        'repeats': repeats,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'max': max(timings),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = {}
+    for name, current in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if reference is None:
+            continue
+        ratio = current['median'] / reference['median'] if reference['median'] else None
+        current['baseline_median'] = reference['median']
+        current['ratio'] = ratio
+        if ratio is not None and ratio > 1 + tolerance:
+            regressions[name] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2, help='durée minimale d\'une répétition (s)')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', action='append', default=[], help='cas à exécuter : nom exact ou motif fnmatch')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.15, help='dérive tolérée sur la médiane')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--output', help='fichier JSON de résultats (sinon sortie standard)')
+    args = parser.parse_args(argv)
+
+    app = _import_app()
+    workdir = tempfile.mkdtemp(prefix='dpe-micro-')
+    cases = build_cases(app, workdir)
+    unmatched = [pattern for pattern in args.only if not fnmatch.filter(cases, pattern)]
+    if unmatched:
+        parser.error(f"aucun cas ne correspond à {', '.join(unmatched)} (cas : {', '.join(cases)})")
+    results = {}
+    for name, fn in cases.items():
+        if args.only and not any(fnmatch.fnmatchcase(name, pattern) for pattern in args.only):
+            continue
+        results[name] = measure(fn, args.repeats, args.min_time, args.warmup)
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    regressions = {}
+    if args.save_baseline:
+        # Les cas non mesurés (--only) gardent leur référence
+        saved = dict(report, results={})
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                saved['results'] = json.load(file).get('results', {})
+        saved['results'].update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            file.write(json.dumps(saved, indent=2, sort_keys=True) + '\n')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        report['regressions'] = regressions
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+    for name, ratio in sorted(regressions.items()):
+        sys.stderr.write(f"Régression : {name} est {ratio:.2f}x plus lent que la référence\n")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Rejoue des livraisons WooCommerce enregistrées (JSONL) contre l'application.
+
+Exemples :
+    python -m bench.replay livraisons.jsonl --concurrency 16
+    python -m bench.replay livraisons-*.jsonl.gz --rate 20 --url http://localhost:8080
+    python -m bench.replay livraisons.jsonl --speed 2 --fresh-delivery-ids
+
+Chaque ligne décrit une livraison : {"ts", "method", "path", "headers", "body"}
+(ou "body_b64" pour un corps non UTF-8), plus éventuellement "status" et
+"latency_ms" tels qu'enregistrés. C'est le format écrit par l'enregistreur de
+l'application ; les fichiers .gz sont décompressés à la volée.
+
+Par défaut les livraisons partent aussi vite que possible sur --concurrency
+workers ; --rate fixe un débit constant, --speed respecte l'espacement d'origine
+(accéléré d'autant). Les corps sont re-signés avec --secret, sauf --keep-signature.
+Sans --url, l'application est chargée dans le processus comme pour bench.load.
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.load import BENCH_SECRET, HttpTarget, InProcessTarget, setup_in_process, sign
+from bench.stats import summarize
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def read_deliveries(paths):
+    for path in paths:
+        with _open(path) as file:
+            for number, line in enumerate(file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    sys.stderr.write(f"{path}:{number} : ligne JSON invalide ignorée\n")
+                    continue
+                if 'headers' not in record or not ('body' in record or 'body_b64' in record):
+                    sys.stderr.write(f"{path}:{number} : pas une livraison enregistrée, ignorée\n")
+                    continue
+                yield record
+
+
+def delivery_body(record):
+    if 'body_b64' in record:
+        return base64.b64decode(record['body_b64'])
+    return record['body'].encode('utf-8')
+
+
+def prepare(record, args, index):
+    body = delivery_body(record)
+    # Les noms d'en-têtes sont insensibles à la casse : on normalise avant de les réécrire
+    headers = {name.title(): value for name, value in record['headers'].items()
+               if name.lower() not in ('content-length', 'host')}
+    if not args.keep_signature:
+        headers['X-Wc-Webhook-Signature'] = sign(body, args.secret)
+    if args.fresh_delivery_ids:
+        original = headers.get('X-Wc-Webhook-Delivery-Id', '')
+        headers['X-Wc-Webhook-Delivery-Id'] = f'{original}-replay-{args.run_id}-{index}'
+    return record.get('path', '/wcwebhook'), body, headers
+
+
+def schedule(records, args):
+    # Instant de départ de chaque livraison, relatif au début du rejeu (None = au plus vite)
+    if args.rate:
+        return [index / args.rate for index in range(len(records))]
+    if args.speed:
+        first = records[0].get('ts', 0) if records else 0
+        return [max(0.0, (record.get('ts', first) - first) / args.speed) for record in records]
+    return [None] * len(records)
+
+
+def run(args):
+    records = list(read_deliveries(args.files))
+    if args.limit:
+        records = records[:args.limit]
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        workdir = tempfile.mkdtemp(prefix='dpe-replay-')
+        os.chdir(workdir)
+        app_module, _ = setup_in_process(args, workdir)
+        target = InProcessTarget(app_module)
+
+    offsets = schedule(records, args)
+    lock = threading.Lock()
+    latencies, codes = [], {}
+    mismatches = {}
+    lateness = []
+    started = time.perf_counter()
+
+    def one_delivery(index):
+        record = records[index]
+        path, body, headers = prepare(record, args, index)
+        if offsets[index] is not None:
+            delay = started + offsets[index] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                with lock:
+                    lateness.append(-delay)
+        start = time.perf_counter()
+        status, _ = target.post(path, body, headers)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            codes[status] = codes.get(status, 0) + 1
+            recorded = record.get('status')
+            if recorded is not None and recorded != status:
+                key = f'{recorded}->{status}'
+                mismatches[key] = mismatches.get(key, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one_delivery, range(len(records))))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'config': {
+            'files': args.files,
+            'deliveries': len(records),
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'speed': args.speed,
+            'target': args.url or 'in-process',
+            'resigned': not args.keep_signature,
+        },
+        'elapsed_seconds': elapsed,
+        'deliveries_per_second': len(records) / elapsed if elapsed else None,
+        'status_codes': {str(code): count for code, count in sorted(codes.items())},
+        'status_mismatches': mismatches,
+        'latency_seconds': summarize(latencies),
+        'schedule_lag_seconds': summarize(lateness),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='fichiers JSONL (éventuellement .gz), dans l\'ordre')
+    parser.add_argument('--url', help='URL d\'une instance démarrée (sinon client de test Flask)')
+    parser.add_argument('--concurrency', type=int, default=8, help='livraisons simultanées')
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument('--rate', type=float, help='débit constant en livraisons par seconde')
+    pace.add_argument('--speed', type=float, help='facteur d\'accélération de l\'horaire enregistré')
+    parser.add_argument('--limit', type=int, help='ne rejouer que les N premières livraisons')
+    parser.add_argument('--secret', default=BENCH_SECRET, help='clé utilisée pour re-signer les corps')
+    parser.add_argument('--keep-signature', action='store_true',
+                        help='conserver la signature enregistrée (rejeu vers l\'instance d\'origine)')
+    parser.add_argument('--fresh-delivery-ids', action='store_true',
+                        help='suffixer les Delivery-ID pour contourner la déduplication')
+    # Application dans le processus : mêmes options que bench.load
+    parser.add_argument('--rows', type=int, default=20000, help='DPE distincts du jeu SQLite généré')
+    parser.add_argument('--sqlite', help='base SQLite existante (voir bench.generate_dataset)')
+    parser.add_argument('--dsn', help='DSN d\'un Postgres local à la place de SQLite')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--env', action='append', default=[], metavar='CLE=VALEUR',
+                        help='variable d\'environnement appliquée avant l\'import de app')
+    parser.add_argument('--output', help='fichier JSON de résultats (sinon sortie standard)')
+    args = parser.parse_args(argv)
+    args.run_id = f'{int(time.time())}'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.files = [os.path.abspath(path) for path in args.files]
+    if args.sqlite:
+        args.sqlite = os.path.abspath(args.sqlite)
+    output = os.path.abspath(args.output) if args.output else None
+    results = run(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
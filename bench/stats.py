@@ -0,0 +1,71 @@
+import math
+import re
+import statistics
+
+
+def summarize(values):
+    # Percentiles par rang le plus proche, en millisecondes si les valeurs sont en secondes
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pct(q):
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'stdev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'min': ordered[0],
+        'p50': pct(0.50),
+        'p90': pct(0.90),
+        'p99': pct(0.99),
+        'max': ordered[-1],
+    }
+
+
+_SAMPLE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>[^}]*)\})?\s+(?P<value>\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_prometheus(text):
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = _SAMPLE.match(line)
+        if match is None:
+            continue
+        labels = dict(_LABEL.findall(match.group('labels') or ''))
+        samples.append((match.group('name'), labels, float(match.group('value'))))
+    return samples
+
+
+def histogram_quantiles(samples, name, label, quantiles=(0.5, 0.9, 0.99)):
+    # Même calcul que histogram_quantile() de Prometheus, par valeur du label donné
+    buckets = {}
+    for sample_name, labels, value in samples:
+        if sample_name == f'{name}_bucket':
+            buckets.setdefault(labels.get(label), []).append((float(labels['le']), value))
+    result = {}
+    for key, points in buckets.items():
+        points.sort()
+        total = points[-1][1]
+        if not total:
+            continue
+        summary = {'count': int(total)}
+        for q in quantiles:
+            rank = q * total
+            lower_bound, lower_count = 0.0, 0.0
+            for bound, cumulative in points:
+                if cumulative >= rank:
+                    if math.isinf(bound):
+                        value = lower_bound
+                    else:
+                        span = cumulative - lower_count
+                        value = lower_bound + (bound - lower_bound) * ((rank - lower_count) / span if span else 0)
+                    break
+                lower_bound, lower_count = bound, cumulative
+            summary[f'p{round(q * 100)}'] = value
+        result[key] = summary
+    return result
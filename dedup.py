@@ -0,0 +1,140 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MAX = int(os.environ.get('DEDUP_MAX', '10000'))
+# Fichier SQLite optionnel pour garder la déduplication après un redémarrage
+DEDUP_DB_PATH = os.environ.get('DEDUP_DB_PATH')
+# Durée de conservation des clés dans ce fichier (WooCommerce ne relivre plus au-delà),
+# et fréquence de la purge
+DEDUP_RETENTION = float(os.environ.get('DEDUP_RETENTION', str(7 * 24 * 3600)))
+DEDUP_PRUNE_INTERVAL = float(os.environ.get('DEDUP_PRUNE_INTERVAL', '3600'))
+
+
+class DeliveryDeduplicator:
+    def __init__(self, maxsize=DEDUP_MAX, db_path=DEDUP_DB_PATH, retention=DEDUP_RETENTION,
+                 prune_interval=DEDUP_PRUNE_INTERVAL):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()
+        self.db_path = db_path
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._db = None
+        self._stats = {'duplicates': 0, 'claims': 0, 'pruned': 0}
+        self._open_db()
+
+    def _open_db(self):
+        self._pruned_at = time.monotonic()
+        if not self.db_path:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS webhook_dedup '
+                         '(key TEXT PRIMARY KEY, job_id TEXT NOT NULL, created_at REAL NOT NULL)')
+        self._db.commit()
+
+    def after_fork(self):
+        # Une connexion SQLite ne doit pas traverser un fork
+        self._lock = threading.Lock()
+        self._open_db()
+
+    def _lookup(self, key, is_live):
+        # -> job_id encore actif pour cette clé, sinon None. Un job inconnu de l'exécuteur
+        # (clé d'avant un redémarrage, historique purgé, réservation pas encore soumise)
+        # a déjà été lancé ou va l'être : la livraison reste un doublon.
+        job_id = self._recent.get(key)
+        if job_id is not None:
+            self._recent.move_to_end(key)
+        elif self._db is not None:
+            row = self._db.execute('SELECT job_id FROM webhook_dedup WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                job_id = row[0]
+                self._remember(key, job_id)
+        if job_id is not None and is_live(job_id, unknown=True):
+            return job_id
+        return None
+
+    def _remember(self, key, job_id):
+        self._recent[key] = job_id
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.maxsize:
+            self._recent.popitem(last=False)
+
+    def find(self, keys, is_live):
+        with self._lock:
+            for key in keys:
+                job_id = self._lookup(key, is_live)
+                if job_id is not None:
+                    self._stats['duplicates'] += 1
+                    return job_id
+        return None
+
+    def claim(self, keys, job_id, is_live):
+        # Vérification et réservation atomiques : deux livraisons simultanées de la
+        # même commande ne peuvent pas lancer deux jobs.
+        with self._lock:
+            for key in keys:
+                existing = self._lookup(key, is_live)
+                if existing is not None:
+                    self._stats['duplicates'] += 1
+                    return existing
+            self._store(keys, job_id)
+            self._stats['claims'] += 1
+        return None
+
+    def assign(self, keys, job_id):
+        # Rattache les clés à un job existant (réservation annulée au profit de ce job)
+        with self._lock:
+            self._store(keys, job_id)
+
+    def release(self, keys, job_id):
+        # Annule une réservation dont le job n'a pas pu être soumis ; les clés rattachées
+        # entre-temps à un autre job sont conservées
+        with self._lock:
+            for key in keys:
+                if self._recent.get(key) == job_id:
+                    del self._recent[key]
+            if self._db is not None:
+                self._db.executemany('DELETE FROM webhook_dedup WHERE key = ? AND job_id = ?',
+                                     [(key, job_id) for key in keys])
+                self._db.commit()
+
+    def _store(self, keys, job_id):
+        for key in keys:
+            self._remember(key, job_id)
+        if self._db is not None:
+            now = time.time()
+            self._db.executemany('INSERT OR REPLACE INTO webhook_dedup (key, job_id, created_at) '
+                                 'VALUES (?, ?, ?)', [(key, job_id, now) for key in keys])
+            self._prune(now)
+            self._db.commit()
+
+    def _prune(self, now):
+        # Au plus une fois par intervalle, dans la même transaction que l'écriture
+        if not self.retention or time.monotonic() - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = time.monotonic()
+        cursor = self._db.execute('DELETE FROM webhook_dedup WHERE created_at < ?', (now - self.retention,))
+        self._stats['pruned'] += cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=len(self._recent), durable=self._db is not None)
+        return stats
+
+
+def dedup_keys(delivery_id=None, order_id=None):
+    keys = []
+    if delivery_id:
+        keys.append(f"delivery:{delivery_id}")
+    if order_id is not None:
+        keys.append(f"order:{order_id}")
+    return keys
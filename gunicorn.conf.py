@@ -0,0 +1,48 @@
+import os
+
+
+# Configuration du serveur de production (Procfile : gunicorn -c gunicorn.conf.py app:app)
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+# Sans file durable (JOB_QUEUE_URL), la table des jobs est propre à chaque processus :
+# un seul worker par défaut pour que GET /jobs/<id> retrouve toujours le job
+workers = int(os.environ.get('WEB_CONCURRENCY', '2' if os.environ.get('JOB_QUEUE_URL') else '1'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Import de l'application dans le maître pour partager la mémoire en copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Recyclage progressif des workers pour contenir les fuites mémoire
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+accesslog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+if preload_app:
+    # Le maître ne doit ouvrir ni connexion Redshift ni thread : chaque worker le fait après le fork
+    os.environ['WSGI_PRELOAD'] = '1'
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and not os.environ.get('JOB_QUEUE_URL'):
+        server.log.warning("%d workers sans JOB_QUEUE_URL : chaque worker a sa propre table de jobs, "
+                           "GET /jobs/<id> répond 404 si la requête arrive sur un autre worker",
+                           server.cfg.workers)
+
+
+def worker_exit(server, worker):
+    # Recyclage (max_requests) ou arrêt : les jobs déjà acquittés sont terminés avant la
+    # fin de l'interpréteur, dans la limite du délai avant que le maître tue le worker
+    import app
+    app.executor.stop(timeout=min(server.cfg.graceful_timeout, server.cfg.timeout) - 1)
+
+
+def post_fork(server, worker):
+    # Sans preload, l'import dans le worker a déjà démarré les threads d'arrière-plan
+    if server.cfg.preload_app:
+        import app
+        app.after_fork()
@@ -0,0 +1,113 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+
+
+# Taille maximale d'une livraison acceptée et taille des blocs lus sur le socket
+WEBHOOK_MAX_BYTES = int(os.environ.get('WEBHOOK_MAX_BYTES', str(1024 * 1024)))
+WEBHOOK_READ_CHUNK = int(os.environ.get('WEBHOOK_READ_CHUNK', str(64 * 1024)))
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+def read_signed_body(stream, macs, max_bytes=WEBHOOK_MAX_BYTES, chunk_size=WEBHOOK_READ_CHUNK):
+    # Lit le corps brut une seule fois en alimentant chaque HMAC bloc par bloc, et le
+    # borne au fil de la lecture (le Content-Length peut manquer en transfert par morceaux).
+    first = stream.read(chunk_size)
+    if len(first) > max_bytes:
+        raise PayloadTooLarge(len(first))
+    for mac in macs:
+        mac.update(first)
+    chunk = stream.read(chunk_size)
+    if not chunk:
+        # Cas courant : toute la livraison tient dans un bloc, renvoyé sans copie
+        return first
+    buffer = bytearray(first)
+    while chunk:
+        if len(buffer) + len(chunk) > max_bytes:
+            raise PayloadTooLarge(len(buffer) + len(chunk))
+        for mac in macs:
+            mac.update(chunk)
+        buffer += chunk
+        chunk = stream.read(chunk_size)
+    return buffer
+
+
+def decode_signature(received_base64):
+    try:
+        return base64.b64decode(received_base64, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class SigningKey:
+    # HMAC-SHA256 déjà initialisé avec le secret, copié pour chaque livraison ;
+    # previous : secret conservé le temps d'une rotation
+    def __init__(self, key_id, secret, previous=False):
+        self.key_id = key_id
+        self.mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        self.previous = previous
+
+
+def _normalize_source(source):
+    return (source or '').strip().rstrip('/').lower()
+
+
+class Keyring:
+    # Secrets actifs (courant + précédent pendant une rotation), globaux ou propres à
+    # une boutique (X-WC-Webhook-Source). Chaque secret est gardé sous forme de HMAC
+    # déjà initialisé avec la clé, copié à chaque requête.
+    def __init__(self, default=(), by_source=None):
+        # default : [(key_id, secret, previous)] ; by_source : {source: [(key_id, secret, previous)]}
+        self._default = self._prekey(default)
+        self._by_source = {_normalize_source(source): self._prekey(keys)
+                           for source, keys in (by_source or {}).items()}
+
+    @staticmethod
+    def _prekey(keys):
+        return [SigningKey(key_id, secret, previous) for key_id, secret, previous in keys if secret]
+
+    def __bool__(self):
+        return bool(self._default) or any(self._by_source.values())
+
+    @property
+    def per_source(self):
+        # Sans secret par boutique, inutile de lire X-WC-Webhook-Source
+        return bool(self._by_source)
+
+    def candidates(self, source):
+        # Une boutique configurée n'accepte que ses propres secrets ; les autres sources
+        # se rabattent sur les secrets globaux. Le coût ne dépend pas du nombre de boutiques.
+        keys = self._by_source.get(_normalize_source(source)) if self._by_source else None
+        return keys if keys is not None else self._default
+
+    def verify(self, stream, received_base64, source=None):
+        # -> (corps, SigningKey) ; la clé vaut None si aucune ne correspond
+        candidates = self.candidates(source)
+        macs = [key.mac.copy() for key in candidates]
+        body = read_signed_body(stream, macs)
+        received = decode_signature(received_base64)
+        if received is None:
+            return body, None
+        for key, mac in zip(candidates, macs):
+            if hmac.compare_digest(received, mac.digest()):
+                return body, key
+        return body, None
+
+
+def keyring_from_env(current=None, previous=None, stores=None):
+    # WC_KEY / WC_KEY_PREVIOUS pour toutes les sources, et WC_KEYS (JSON) par boutique :
+    # {"https://boutique.example.com/": {"2024-06": "secret", "2024-01": "ancien"}}
+    # Le premier secret d'une boutique est le courant, les suivants sont en rotation.
+    default = [('current', current, False), ('previous', previous, True)]
+    by_source = {}
+    if stores:
+        for source, keys in json.loads(stores).items():
+            by_source[source] = [(f'{_normalize_source(source)}#{key_id}', secret, index > 0)
+                                 for index, (key_id, secret) in enumerate(keys.items())]
+    return Keyring(default, by_source)
@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Délai avant qu'un job réclamé mais non terminé redevienne visible (worker mort)
+VISIBILITY_TIMEOUT = float(os.environ.get('JOB_VISIBILITY_TIMEOUT', '900'))
+MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '10'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+# Nombre maximal de tentatives atteint : le job reste dans la table comme lettre morte
+DEAD = 'dead'
+CANCELLED = 'cancelled'
+# Erreur d'un job dont le worker est mort (OOM, SIGKILL) à sa dernière tentative
+LEASE_EXPIRED_ERROR = 'bail expiré sans fin de traitement, tentatives épuisées'
+
+COLUMNS = ('id', 'kind', 'status', 'payload', 'meta', 'attempts', 'max_attempts', 'available_at',
+           'locked_by', 'locked_until', 'created_at', 'started_at', 'finished_at', 'result', 'error')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dpe_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    meta TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at DOUBLE PRECISION NOT NULL,
+    locked_by TEXT,
+    locked_until DOUBLE PRECISION,
+    created_at DOUBLE PRECISION NOT NULL,
+    started_at DOUBLE PRECISION,
+    finished_at DOUBLE PRECISION,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_dpe_jobs_claim ON dpe_jobs (status, available_at);
+"""
+
+
+def _row_to_job(row):
+    job = dict(zip(COLUMNS, row))
+    job['payload'] = json.loads(job['payload'])
+    job['meta'] = json.loads(job['meta']) if job['meta'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def retry_delay(attempts):
+    # Attente exponentielle entre les tentatives
+    return RETRY_DELAY * (2 ** max(0, attempts - 1))
+
+
+class SQLiteJobQueue:
+    # Backend mono-noeud : fichier SQLite en WAL, réservation dans une transaction IMMEDIATE
+    def __init__(self, path, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA.replace('DOUBLE PRECISION', 'REAL'))
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._open()
+
+    def enqueue(self, job_id, kind, payload, meta=None, delay=0.0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO dpe_jobs (id, kind, status, payload, meta, attempts, max_attempts, '
+                'available_at, created_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)',
+                (job_id, kind, QUEUED, json.dumps(payload), json.dumps(meta or {}),
+                 self.max_attempts, now + delay, now))
+
+    def claim(self, worker_id, limit):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Un job qui tue son worker n'atteint jamais fail() : bail expiré à la
+                # dernière tentative, il passe en lettre morte au lieu d'être redistribué
+                expired = self._conn.execute(
+                    'UPDATE dpe_jobs SET status = ?, error = ?, finished_at = ?, locked_by = NULL, '
+                    'locked_until = NULL WHERE status = ? AND locked_until < ? AND attempts >= max_attempts',
+                    (DEAD, LEASE_EXPIRED_ERROR, now, RUNNING, now)).rowcount
+                rows = self._conn.execute(
+                    f'SELECT {", ".join(COLUMNS)} FROM dpe_jobs '
+                    'WHERE (status = ? AND available_at <= ?) OR (status = ? AND locked_until < ?) '
+                    'ORDER BY available_at LIMIT ?',
+                    (QUEUED, now, RUNNING, now, limit)).fetchall()
+                jobs = [_row_to_job(row) for row in rows]
+                for job in jobs:
+                    self._conn.execute(
+                        'UPDATE dpe_jobs SET status = ?, locked_by = ?, locked_until = ?, '
+                        'attempts = attempts + 1, started_at = COALESCE(started_at, ?) WHERE id = ?',
+                        (RUNNING, worker_id, now + self.visibility_timeout, now, job['id']))
+                    job['attempts'] += 1
+                    job['status'] = RUNNING
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        if expired:
+            logger.error("%d job(s) en lettre morte : bail expiré après la dernière tentative", expired)
+        return jobs
+
+    def extend(self, job_ids, worker_id):
+        # Prolonge le bail des jobs encore tenus par ce worker -> nombre de baux prolongés
+        with self._lock:
+            cursor = self._conn.executemany(
+                'UPDATE dpe_jobs SET locked_until = ? WHERE id = ? AND status = ? AND locked_by = ?',
+                [(time.time() + self.visibility_timeout, job_id, RUNNING, worker_id) for job_id in job_ids])
+            return cursor.rowcount
+
+    # complete() et fail() ne s'appliquent que si le worker tient encore le bail : sinon le
+    # job a été repris ailleurs et c'est cette autre exécution qui conclut (False / None)
+    def complete(self, job_id, result, worker_id):
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE dpe_jobs SET status = ?, result = ?, finished_at = ?, locked_by = NULL, '
+                'locked_until = NULL WHERE id = ? AND status = ? AND locked_by = ?',
+                (DONE, json.dumps(result), time.time(), job_id, RUNNING, worker_id))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, error, attempts, max_attempts, worker_id):
+        now = time.time()
+        with self._lock:
+            if attempts >= max_attempts:
+                cursor = self._conn.execute(
+                    'UPDATE dpe_jobs SET status = ?, error = ?, finished_at = ?, locked_by = NULL, '
+                    'locked_until = NULL WHERE id = ? AND status = ? AND locked_by = ?',
+                    (DEAD, error, now, job_id, RUNNING, worker_id))
+                return DEAD if cursor.rowcount == 1 else None
+            cursor = self._conn.execute(
+                'UPDATE dpe_jobs SET status = ?, error = ?, available_at = ?, locked_by = NULL, '
+                'locked_until = NULL WHERE id = ? AND status = ? AND locked_by = ?',
+                (QUEUED, error, now + retry_delay(attempts), job_id, RUNNING, worker_id))
+            return QUEUED if cursor.rowcount == 1 else None
+
+    def retry(self, job_id, error, delay, worker_id):
+        # Échec passager (dépendance saturée) : remis en file sans consommer de tentative
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE dpe_jobs SET status = ?, error = ?, available_at = ?, attempts = attempts - 1, '
+                'locked_by = NULL, locked_until = NULL WHERE id = ? AND status = ? AND locked_by = ?',
+                (QUEUED, error, time.time() + delay, job_id, RUNNING, worker_id))
+            return cursor.rowcount == 1
+
+    def cancel(self, job_id):
+        # Seul un job encore en file peut être annulé
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE dpe_jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+                (CANCELLED, time.time(), job_id, QUEUED))
+            return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f'SELECT {", ".join(COLUMNS)} FROM dpe_jobs WHERE id = ?',
+                                     (job_id,)).fetchone()
+        return _row_to_job(row) if row is not None else None
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM dpe_jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+
+class PostgresJobQueue:
+    # Backend multi-workers : table Postgres réservée avec FOR UPDATE SKIP LOCKED
+    def __init__(self, dsn, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        import psycopg2
+        from redshift_pool import ConnectionPool
+
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._pool = ConnectionPool(lambda: psycopg2.connect(dsn), name='job_queue')
+        with self._pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(SCHEMA)
+            conn.commit()
+
+    def after_fork(self):
+        self._pool.after_fork()
+
+    def _execute(self, query, params, fetch=None):
+        with self._pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall() if fetch == 'all' else cursor.fetchone() if fetch == 'one' else None
+            rowcount = cursor.rowcount
+            conn.commit()
+        return rows if fetch else rowcount
+
+    def enqueue(self, job_id, kind, payload, meta=None, delay=0.0):
+        now = time.time()
+        self._execute(
+            'INSERT INTO dpe_jobs (id, kind, status, payload, meta, attempts, max_attempts, '
+            'available_at, created_at) VALUES (%s, %s, %s, %s, %s, 0, %s, %s, %s)',
+            (job_id, kind, QUEUED, json.dumps(payload), json.dumps(meta or {}),
+             self.max_attempts, now + delay, now))
+
+    def claim(self, worker_id, limit):
+        # Les lignes déjà verrouillées par un autre worker sont sautées, sans attente
+        now = time.time()
+        # Bail expiré à la dernière tentative (worker tué) : lettre morte, voir SQLiteJobQueue.claim
+        expired = self._execute(
+            'UPDATE dpe_jobs SET status = %s, error = %s, finished_at = %s, locked_by = NULL, '
+            'locked_until = NULL WHERE status = %s AND locked_until < %s AND attempts >= max_attempts',
+            (DEAD, LEASE_EXPIRED_ERROR, now, RUNNING, now))
+        if expired:
+            logger.error("%d job(s) en lettre morte : bail expiré après la dernière tentative", expired)
+        rows = self._execute(
+            'UPDATE dpe_jobs SET status = %s, locked_by = %s, locked_until = %s, '
+            'attempts = attempts + 1, started_at = COALESCE(started_at, %s) '
+            'WHERE id IN (SELECT id FROM dpe_jobs '
+            '             WHERE (status = %s AND available_at <= %s) OR (status = %s AND locked_until < %s) '
+            '             ORDER BY available_at LIMIT %s FOR UPDATE SKIP LOCKED) '
+            f'RETURNING {", ".join(COLUMNS)}',
+            (RUNNING, worker_id, now + self.visibility_timeout, now, QUEUED, now, RUNNING, now, limit),
+            fetch='all')
+        return [_row_to_job(row) for row in rows]
+
+    def extend(self, job_ids, worker_id):
+        if not job_ids:
+            return 0
+        return self._execute(
+            'UPDATE dpe_jobs SET locked_until = %s WHERE id IN %s AND status = %s AND locked_by = %s',
+            (time.time() + self.visibility_timeout, tuple(job_ids), RUNNING, worker_id))
+
+    def complete(self, job_id, result, worker_id):
+        rowcount = self._execute(
+            'UPDATE dpe_jobs SET status = %s, result = %s, finished_at = %s, locked_by = NULL, '
+            'locked_until = NULL WHERE id = %s AND status = %s AND locked_by = %s',
+            (DONE, json.dumps(result), time.time(), job_id, RUNNING, worker_id))
+        return rowcount == 1
+
+    def fail(self, job_id, error, attempts, max_attempts, worker_id):
+        now = time.time()
+        if attempts >= max_attempts:
+            rowcount = self._execute(
+                'UPDATE dpe_jobs SET status = %s, error = %s, finished_at = %s, locked_by = NULL, '
+                'locked_until = NULL WHERE id = %s AND status = %s AND locked_by = %s',
+                (DEAD, error, now, job_id, RUNNING, worker_id))
+            return DEAD if rowcount == 1 else None
+        rowcount = self._execute(
+            'UPDATE dpe_jobs SET status = %s, error = %s, available_at = %s, locked_by = NULL, '
+            'locked_until = NULL WHERE id = %s AND status = %s AND locked_by = %s',
+            (QUEUED, error, now + retry_delay(attempts), job_id, RUNNING, worker_id))
+        return QUEUED if rowcount == 1 else None
+
+    def retry(self, job_id, error, delay, worker_id):
+        rowcount = self._execute(
+            'UPDATE dpe_jobs SET status = %s, error = %s, available_at = %s, attempts = attempts - 1, '
+            'locked_by = NULL, locked_until = NULL WHERE id = %s AND status = %s AND locked_by = %s',
+            (QUEUED, error, time.time() + delay, job_id, RUNNING, worker_id))
+        return rowcount == 1
+
+    def cancel(self, job_id):
+        rowcount = self._execute(
+            'UPDATE dpe_jobs SET status = %s, finished_at = %s WHERE id = %s AND status = %s',
+            (CANCELLED, time.time(), job_id, QUEUED))
+        return rowcount == 1
+
+    def get(self, job_id):
+        row = self._execute(f'SELECT {", ".join(COLUMNS)} FROM dpe_jobs WHERE id = %s', (job_id,),
+                            fetch='one')
+        return _row_to_job(row) if row is not None else None
+
+    def counts(self):
+        return dict(self._execute('SELECT status, COUNT(*) FROM dpe_jobs GROUP BY status', (), fetch='all'))
+
+
+def open_job_queue(url):
+    # sqlite:///chemin/vers/jobs.db ou postgresql://utilisateur@hote/base
+    if url.startswith('sqlite:///'):
+        return SQLiteJobQueue(url[len('sqlite:///'):])
+    if url.startswith(('postgres://', 'postgresql://')):
+        return PostgresJobQueue(url)
+    raise ValueError(f"Backend de file de jobs non supporté : {url}")
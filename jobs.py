@@ -0,0 +1,344 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# Taille du pool de workers et nombre de jobs terminés conservés pour consultation
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_HISTORY_MAX = int(os.environ.get('JOB_HISTORY_MAX', '1000'))
+# File durable (sqlite:///jobs.db ou postgresql://...) ; file en mémoire si absent
+JOB_QUEUE_URL = os.environ.get('JOB_QUEUE_URL')
+JOB_CLAIM_BATCH = int(os.environ.get('JOB_CLAIM_BATCH', '4'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+# Prolongation du bail des jobs en cours, bien en deçà de JOB_VISIBILITY_TIMEOUT
+JOB_LEASE_RENEW_INTERVAL = float(os.environ.get('JOB_LEASE_RENEW_INTERVAL', '60'))
+# Relance d'un job après un échec passager (RetryLater) : attente exponentielle bornée en
+# mémoire, fixe pour la file durable (la tentative n'y est pas décomptée)
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '10'))
+JOB_RETRY_DELAY_MAX = float(os.environ.get('JOB_RETRY_DELAY_MAX', '300'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+DEAD = 'dead'
+CANCELLED = 'cancelled'
+
+# Fonctions exécutables par la file durable, par nom : seul le nom et les arguments
+# (sérialisables en JSON) sont stockés avec le job.
+HANDLERS = {}
+
+
+def register_handler(fn):
+    HANDLERS[fn.__name__] = fn
+    return fn
+
+
+class RetryLater(Exception):
+    # Échec passager (dépendance saturée...) : le job est relancé plus tard au lieu
+    # d'être marqué en échec, la livraison ayant déjà été acquittée
+    pass
+
+
+class JobExecutor:
+    def __init__(self, max_workers=JOB_WORKERS, history_max=JOB_HISTORY_MAX):
+        self.max_workers = max_workers
+        self.history_max = history_max
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pool = None
+
+    def _get_pool(self):
+        # Le pool est créé au premier job pour ne pas démarrer de threads à l'import
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='dpe-job')
+            return self._pool
+
+    def after_fork(self):
+        # Les threads du pool n'existent pas dans le processus enfant
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def submit(self, fn, *args, job_id=None, **meta):
+        job_id = job_id or uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': QUEUED,
+            'meta': meta,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            'attempts': 0,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+            snapshot = dict(job)
+        self._get_pool().submit(self._run, job_id, fn, args)
+        logger.info("Job %s mis en file (%s)", job_id, meta)
+        return snapshot
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=None):
+        # Arrêt du processus (recyclage gunicorn) : attente des jobs en file ou en cours,
+        # déjà acquittés auprès de WooCommerce, au plus `timeout` secondes
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending_count():
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning("Arrêt avec %d job(s) en mémoire non terminés", self.pending_count())
+                return False
+            time.sleep(0.1)
+        return True
+
+    def is_live(self, job_id, unknown=False):
+        # Un job connu, ni échoué ni annulé : une nouvelle livraison ne doit pas le relancer.
+        # Un job inconnu (processus précédent, historique purgé) vaut `unknown`.
+        job = self.get(job_id)
+        if job is None:
+            return unknown
+        return job['status'] not in (FAILED, CANCELLED)
+
+    def cancel(self, job_id):
+        # Seul un job encore en file peut être annulé ; _run le sautera
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                return False
+            job.update(status=CANCELLED, finished_at=time.time())
+        logger.info("Job %s annulé avant exécution", job_id)
+        return True
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] in (QUEUED, RUNNING))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _run(self, job_id, fn, args):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                return
+            job.update(status=RUNNING, started_at=time.time(), attempts=job['attempts'] + 1)
+        try:
+            result = fn(*args)
+        except RetryLater as e:
+            self._retry_later(job_id, fn, args, e)
+        except Exception as e:
+            logger.exception("Échec du job %s : %s", job_id, e)
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status=DONE, result=result, error=None, finished_at=time.time())
+
+    def _retry_later(self, job_id, fn, args, error):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(status=QUEUED, error=str(error))
+            attempts = job['attempts']
+        delay = min(JOB_RETRY_DELAY * 2 ** (attempts - 1), JOB_RETRY_DELAY_MAX)
+        logger.warning("Job %s relancé dans %.0f s (tentative %d) : %s", job_id, delay, attempts, error)
+        timer = threading.Timer(delay, lambda: self._get_pool().submit(self._run, job_id, fn, args))
+        timer.daemon = True
+        timer.start()
+
+    def _prune(self):
+        # On ne supprime que les jobs terminés, les plus anciens d'abord
+        excess = len(self._jobs) - self.history_max
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id]['status'] in (DONE, FAILED, CANCELLED):
+                del self._jobs[job_id]
+                excess -= 1
+
+
+class DurableJobExecutor:
+    # Même interface que JobExecutor, mais les jobs vivent dans job_queue et sont
+    # réservés par lots par un thread répartiteur qui alimente le pool de workers.
+    def __init__(self, queue, max_workers=JOB_WORKERS, claim_batch=JOB_CLAIM_BATCH,
+                 poll_interval=JOB_POLL_INTERVAL, renew_interval=JOB_LEASE_RENEW_INTERVAL):
+        self.queue = queue
+        self.max_workers = max_workers
+        self.claim_batch = claim_batch
+        self.poll_interval = poll_interval
+        self.renew_interval = renew_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._busy = 0
+        self._running = set()
+        self._pool = None
+        self._thread = None
+        self._heartbeat = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dpe-job')
+            self._thread = threading.Thread(target=self._dispatch, name='dpe-job-dispatcher', daemon=True)
+            self._thread.start()
+            self._heartbeat = threading.Thread(target=self._renew_leases, name='dpe-job-heartbeat', daemon=True)
+            self._heartbeat.start()
+        logger.info("Consommation de la file de jobs démarrée (%s, %d workers)",
+                    self.worker_id, self.max_workers)
+
+    def after_fork(self):
+        self.queue.after_fork()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._busy = 0
+        self._running = set()
+        self._pool = None
+        self._thread = None
+        self._heartbeat = None
+        self._stopping = threading.Event()
+
+    def stop(self, timeout=None):
+        # Arrêt propre : plus aucune réservation, puis attente des jobs en cours. Ceux qui
+        # ne finissent pas à temps seront repris à l'expiration de leur bail.
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._busy == 0
+
+    def submit(self, fn, *args, job_id=None, **meta):
+        kind = fn.__name__
+        if HANDLERS.get(kind) is not fn:
+            raise ValueError(f"{kind} n'est pas enregistré comme handler de job")
+        job_id = job_id or uuid.uuid4().hex
+        self.queue.enqueue(job_id, kind, {'args': list(args)}, meta)
+        self._wakeup.set()
+        logger.info("Job %s mis en file durable (%s)", job_id, meta)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        job = self.queue.get(job_id)
+        if job is None:
+            return None
+        return {key: job[key] for key in ('id', 'status', 'meta', 'created_at', 'started_at',
+                                           'finished_at', 'result', 'error', 'attempts')}
+
+    def is_live(self, job_id, unknown=False):
+        job = self.queue.get(job_id)
+        if job is None:
+            return unknown
+        return job['status'] not in (DEAD, CANCELLED)
+
+    def cancel(self, job_id):
+        cancelled = self.queue.cancel(job_id)
+        if cancelled:
+            logger.info("Job %s annulé avant exécution", job_id)
+        return cancelled
+
+    def pending_count(self):
+        counts = self.queue.counts()
+        return counts.get(QUEUED, 0) + counts.get(RUNNING, 0)
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            with self._cond:
+                while self._busy >= self.max_workers:
+                    self._cond.wait()
+                free = self.max_workers - self._busy
+            if self._stopping.is_set():
+                break
+            try:
+                # Plusieurs jobs par aller-retour, dans la limite des workers libres
+                jobs = self.queue.claim(self.worker_id, min(free, self.claim_batch))
+            except Exception as e:
+                logger.exception("Impossible de réserver des jobs : %s", e)
+                time.sleep(self.poll_interval)
+                continue
+            if not jobs:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            with self._cond:
+                self._busy += len(jobs)
+                self._running.update(job['id'] for job in jobs)
+            for job in jobs:
+                self._pool.submit(self._run, job)
+
+    def _renew_leases(self):
+        # Un extrait long (UNLOAD) ne doit pas voir son bail expirer et être repris en
+        # parallèle par un autre worker tant que celui-ci le traite
+        while not self._stopping.wait(self.renew_interval):
+            with self._cond:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                renewed = self.queue.extend(job_ids, self.worker_id)
+            except Exception as e:
+                logger.warning("Impossible de prolonger le bail de %d job(s) : %s", len(job_ids), e)
+                continue
+            if renewed < len(job_ids):
+                logger.warning("%d job(s) en cours ont perdu leur bail", len(job_ids) - renewed)
+
+    def _run(self, job):
+        try:
+            handler = HANDLERS.get(job['kind'])
+            if handler is None:
+                raise ValueError(f"Aucun handler pour les jobs {job['kind']}")
+            result = handler(*job['payload']['args'])
+        except RetryLater as e:
+            # Saturation passagère : l'attente ne doit pas mener la commande en lettre morte
+            if self.queue.retry(job['id'], str(e), JOB_RETRY_DELAY, self.worker_id):
+                logger.warning("Job %s remis en file dans %.0f s : %s", job['id'], JOB_RETRY_DELAY, e)
+        except Exception as e:
+            status = self.queue.fail(job['id'], str(e), job['attempts'], job['max_attempts'], self.worker_id)
+            logger.exception("Échec du job %s (tentative %d/%d, désormais %s) : %s", job['id'],
+                             job['attempts'], job['max_attempts'], status or 'repris ailleurs', e)
+        else:
+            if not self.queue.complete(job['id'], result, self.worker_id):
+                logger.warning("Job %s terminé après la perte de son bail : résultat ignoré", job['id'])
+        finally:
+            with self._cond:
+                self._busy -= 1
+                self._running.discard(job['id'])
+                self._cond.notify_all()
+
+
+def create_executor():
+    if JOB_QUEUE_URL:
+        from job_queue import open_job_queue
+        return DurableJobExecutor(open_job_queue(JOB_QUEUE_URL))
+    return JobExecutor()
+
+
+executor = create_executor()
@@ -0,0 +1,179 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+
+
+# Niveau, format ('json' ou 'text'), proportion des messages DEBUG conservés, taille
+# maximale d'un message formaté, masquage des emails et téléphones, file vers le thread d'écriture
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '1'))
+LOG_MAX_MESSAGE = int(os.environ.get('LOG_MAX_MESSAGE', '2000'))
+LOG_REDACT_PII = os.environ.get('LOG_REDACT_PII', '1') == '1'
+LOG_QUEUE_MAX = int(os.environ.get('LOG_QUEUE_MAX', '10000'))
+
+_EMAIL = re.compile(r'([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})')
+# Numéros français (06 12 34 56 78, +33 6 12 34 56 78...) : on garde les deux derniers chiffres
+_PHONE = re.compile(r'(?<!\d)(?:\+33\s?|0033\s?|0)[1-9](?:[\s.-]?\d{2}){3}[\s.-]?(\d{2})(?!\d)')
+
+# Attributs standard d'un LogRecord : le reste vient de extra= et part tel quel dans le JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'sample_rate'}
+
+
+def redact_pii(text):
+    text = _EMAIL.sub(r'\1***@\2', text)
+    return _PHONE.sub(r'** ** ** ** \1', text)
+
+
+def truncate(text, limit):
+    if limit and len(text) > limit:
+        return f'{text[:limit]}…[+{len(text) - limit} car.]'
+    return text
+
+
+class SamplingFilter(logging.Filter):
+    # Taux par message avec extra={'sample_rate': 0.01}, sinon LOG_DEBUG_SAMPLE_RATE pour DEBUG.
+    # Appliqué avant la mise en file : un message écarté ne coûte ni formatage ni I/O.
+    def __init__(self, debug_rate=LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.debug_rate = debug_rate
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None:
+            rate = self.debug_rate if record.levelno <= logging.DEBUG else 1.0
+        return rate >= 1.0 or random.random() < rate
+
+
+class _MessageFormatting:
+    def __init__(self, max_message=LOG_MAX_MESSAGE, redact=LOG_REDACT_PII):
+        self.max_message = max_message
+        self.redact = redact
+
+    def render_message(self, record):
+        message = truncate(record.getMessage(), self.max_message)
+        return redact_pii(message) if self.redact else message
+
+
+class JsonFormatter(_MessageFormatting, logging.Formatter):
+    def __init__(self, **kwargs):
+        _MessageFormatting.__init__(self, **kwargs)
+        logging.Formatter.__init__(self)
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': self.render_message(record),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = truncate(record.exc_text, self.max_message * 4)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(_MessageFormatting, logging.Formatter):
+    def __init__(self, **kwargs):
+        _MessageFormatting.__init__(self, **kwargs)
+        logging.Formatter.__init__(self, '%(levelname)s:%(name)s:%(message)s')
+
+    def formatMessage(self, record):
+        record.message = self.render_message(record)
+        return super().formatMessage(record)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare() formate le message dans le thread appelant ; ici seule la
+    # trace d'exception est figée, le formatage et l'écriture ont lieu dans le listener.
+    # File pleine : le message est compté puis abandonné, sans bloquer la requête.
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+def _output_handler():
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    return output
+
+
+def _install(background):
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if background:
+        _handler = DeferredQueueHandler(queue.Queue(maxsize=LOG_QUEUE_MAX))
+        _listener = logging.handlers.QueueListener(_handler.queue, _output_handler())
+        _listener.start()
+    else:
+        _handler = _output_handler()
+    _handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+
+
+def configure_logging():
+    # Remplace la configuration du logger racine ; idempotent. Le maître gunicorn
+    # (--preload) écrit de façon synchrone pour ne démarrer aucun thread avant le fork.
+    with _lock:
+        if _handler is None:
+            _install(background=os.environ.get('WSGI_PRELOAD') != '1')
+            atexit.register(stop_logging)
+
+
+def after_fork():
+    # Le thread d'écriture n'existe pas dans le processus enfant : nouvelle file, nouveau listener
+    global _listener, _lock
+    _lock = threading.Lock()
+    with _lock:
+        _listener = None
+        _install(background=True)
+
+
+def stop_logging():
+    # Vide la file avant l'arrêt du processus
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def stats():
+    dropped = getattr(_handler, 'dropped', 0)
+    pending = _handler.queue.qsize() if isinstance(_handler, DeferredQueueHandler) else 0
+    return {'dropped': dropped, 'pending': pending}
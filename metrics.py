@@ -0,0 +1,173 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Bornes des histogrammes de latence, en secondes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # clé de labels -> [compteurs par borne, somme, total]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        samples = []
+        for key, (counts, total_sum, total_count) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket',
+                                _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))),
+                                cumulative))
+            samples.append((self.name + '_sum', _format_labels(self.labelnames, key), total_sum))
+            samples.append((self.name + '_count', _format_labels(self.labelnames, key), total_count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        # collect() -> [(nom, type, aide, valeur)] évalué à chaque lecture de /metrics
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        for collect in collectors:
+            for name, metric_type, documentation, value in collect():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def stats_collector(prefix, stats, counters=()):
+    # Expose un dict de statistiques existant (pool, cache...) sous forme de métriques
+    def collect():
+        samples = []
+        for key, value in stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in counters:
+                name = key if key.endswith('_total') else f'{key}_total'
+                samples.append((f'{prefix}_{name}', 'counter', f'{prefix} {key}', value))
+            else:
+                samples.append((f'{prefix}_{key}', 'gauge', f'{prefix} {key}', value))
+        return samples
+    return collect
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('wcwebhook_requests_total', 'Livraisons reçues sur /wcwebhook', ['code'])
+STAGE_SECONDS = REGISTRY.histogram('dpe_stage_seconds', 'Durée de chaque étape du traitement', ['stage'])
+STAGE_ERRORS = REGISTRY.counter('dpe_stage_errors_total', 'Erreurs par étape du traitement', ['stage'])
+ROWS_RETURNED = REGISTRY.counter('dpe_rows_returned_total', 'Lignes DPE extraites de Redshift')
+BYTES_UPLOADED = REGISTRY.counter('dpe_s3_bytes_uploaded_total', 'Octets envoyés vers S3')
+WEBHOOK_TOPICS = REGISTRY.counter('wcwebhook_topic_total', 'Livraisons par sujet et aiguillage', ['topic', 'route'])
+ORDER_DECISIONS = REGISTRY.counter('wcwebhook_order_decision_total', 'Commandes par décision de traitement',
+                                   ['decision'])
+SIGNATURE_KEYS = REGISTRY.counter('wcwebhook_signature_key_total', 'Livraisons par secret reconnu', ['key_id'])
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
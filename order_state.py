@@ -0,0 +1,180 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Statuts WooCommerce qui autorisent l'extraction, et ceux qui l'annulent
+ORDER_PAID_STATUSES = [s for s in os.environ.get('ORDER_PAID_STATUSES', 'processing,completed').split(',') if s]
+ORDER_CANCEL_STATUSES = [s for s in os.environ.get('ORDER_CANCEL_STATUSES', 'cancelled,refunded,failed').split(',')
+                         if s]
+ORDER_REQUIRE_DATE_PAID = os.environ.get('ORDER_REQUIRE_DATE_PAID', '1') == '1'
+# Fichier SQLite partagé par les workers et conservé lors de leur recyclage. ':memory:'
+# donne une table par processus : réservé aux essais avec un seul worker.
+ORDER_STATE_DB_PATH = os.environ.get('ORDER_STATE_DB_PATH', 'order_state.db')
+# Durée de conservation d'une commande sans nouvelle livraison, et fréquence de la purge
+ORDER_STATE_RETENTION = float(os.environ.get('ORDER_STATE_RETENTION', str(90 * 24 * 3600)))
+ORDER_STATE_PRUNE_INTERVAL = float(os.environ.get('ORDER_STATE_PRUNE_INTERVAL', '3600'))
+# Une extraction réservée dont le job reste inconnu de l'exécuteur au-delà de ce délai
+# est considérée perdue et relancée à la livraison suivante
+ORDER_LOST_JOB_GRACE = float(os.environ.get('ORDER_LOST_JOB_GRACE', '30'))
+
+PROCESS = 'process'
+WAIT = 'wait'
+CANCEL = 'cancel'
+
+# État d'une commande dans la table : vue mais pas encore payée, extraction lancée,
+# extraction terminée (définitif), annulée
+WAITING = 'waiting'
+QUEUED = 'queued'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+class OrderRules:
+    def __init__(self, paid_statuses=ORDER_PAID_STATUSES, cancel_statuses=ORDER_CANCEL_STATUSES,
+                 require_date_paid=ORDER_REQUIRE_DATE_PAID):
+        self.paid_statuses = frozenset(paid_statuses)
+        self.cancel_statuses = frozenset(cancel_statuses)
+        self.require_date_paid = require_date_paid
+
+    def evaluate(self, order_data):
+        status = order_data.get('status')
+        if status in self.cancel_statuses:
+            return CANCEL
+        if status not in self.paid_statuses:
+            return WAIT
+        if self.require_date_paid and not (order_data.get('date_paid') or order_data.get('date_paid_gmt')):
+            return WAIT
+        return PROCESS
+
+
+class OrderStateStore:
+    # Une ligne par commande : garantit qu'une commande payée n'est extraite qu'une fois,
+    # quel que soit le nombre de livraisons order.updated, et retrouve le job à annuler.
+    def __init__(self, db_path=ORDER_STATE_DB_PATH, retention=ORDER_STATE_RETENTION,
+                 prune_interval=ORDER_STATE_PRUNE_INTERVAL):
+        self.db_path = db_path
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._stats = {'claims': 0, 'duplicates': 0, 'waiting': 0, 'cancelled': 0, 'cancelled_jobs': 0,
+                       'pruned': 0}
+        if db_path == ':memory:' and int(os.environ.get('WEB_CONCURRENCY', '1')) > 1:
+            logger.warning("ORDER_STATE_DB_PATH=:memory: avec plusieurs workers : une commande livrée à "
+                           "deux workers peut être extraite deux fois")
+        self._open()
+
+    def _open(self):
+        self._lock = threading.Lock()
+        self._pruned_at = time.monotonic()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        if self.db_path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS order_state (order_id TEXT PRIMARY KEY, state TEXT NOT NULL, '
+                         'status TEXT, job_id TEXT, updated_at REAL NOT NULL)')
+
+    def after_fork(self):
+        # Une connexion SQLite ne doit pas traverser un fork
+        self._open()
+
+    def _write(self, order_id, state, status, job_id):
+        self._prune()
+        self._db.execute('INSERT OR REPLACE INTO order_state (order_id, state, status, job_id, updated_at) '
+                         'VALUES (?, ?, ?, ?, ?)', (str(order_id), state, status, job_id, time.time()))
+
+    def _prune(self):
+        # Dans la transaction en cours, au plus une fois par intervalle
+        if not self.retention or time.monotonic() - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = time.monotonic()
+        cursor = self._db.execute('DELETE FROM order_state WHERE updated_at < ?', (time.time() - self.retention,))
+        self._stats['pruned'] += cursor.rowcount
+
+    def _read(self, order_id):
+        return self._db.execute('SELECT state, job_id, updated_at FROM order_state WHERE order_id = ?',
+                                (str(order_id),)).fetchone()
+
+    def wait(self, order_id, status):
+        # Commande pas encore payée : on la note sans écraser une extraction lancée ou terminée
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._read(order_id)
+                if row is None or row[0] not in (QUEUED, DONE):
+                    self._write(order_id, WAITING, status, None)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._stats['waiting'] += 1
+
+    def claim(self, order_id, status, job_id, can_retry):
+        # -> job_id existant si la commande a déjà été extraite, ou si son extraction est
+        # en cours (sauf job échoué ou perdu, can_retry(job_id, âge de la réservation)
+        # vrai) ; None si l'extraction est réservée pour job_id
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._read(order_id)
+                if row is not None and (row[0] == DONE or (row[0] == QUEUED and row[1] and not can_retry(row[1], time.time() - row[2]))):
+                    self._db.execute('COMMIT')
+                    self._stats['duplicates'] += 1
+                    return row[1]
+                self._write(order_id, QUEUED, status, job_id)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._stats['claims'] += 1
+        return None
+
+    def cancel(self, order_id, status, cancel_job):
+        # Annulation : le job encore en file est abandonné (cancel_job(job_id) -> bool).
+        # Un job déjà démarré ou terminé est conservé, la commande reste marquée extraite.
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._read(order_id)
+                job_id = row[1] if row is not None and row[0] == QUEUED else None
+                dropped = bool(job_id) and cancel_job(job_id)
+                if (job_id is None and (row is None or row[0] != DONE)) or dropped:
+                    self._write(order_id, CANCELLED, status, job_id)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._stats['cancelled'] += 1
+            if dropped:
+                self._stats['cancelled_jobs'] += 1
+        return job_id, dropped
+
+    def release(self, order_id, job_id):
+        # Réservation dont le job n'a pas pu être soumis : la commande redevient libre
+        with self._lock:
+            self._db.execute('DELETE FROM order_state WHERE order_id = ? AND state = ? AND job_id = ?',
+                             (str(order_id), QUEUED, job_id))
+
+    def complete(self, order_id):
+        # Appelé par le job en fin d'extraction : la commande ne sera plus jamais relancée,
+        # même si l'exécuteur (en mémoire) a oublié le job
+        with self._lock:
+            self._db.execute('UPDATE order_state SET state = ?, updated_at = ? WHERE order_id = ? AND state = ?',
+                             (DONE, time.time(), str(order_id), QUEUED))
+
+    def get(self, order_id):
+        with self._lock:
+            row = self._db.execute('SELECT state, status, job_id, updated_at FROM order_state WHERE order_id = ?',
+                                   (str(order_id),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('state', 'status', 'job_id', 'updated_at'), row), order_id=str(order_id))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            counts = dict(self._db.execute('SELECT state, COUNT(*) FROM order_state GROUP BY state').fetchall())
+        stats.update({f'orders_{state}': counts.get(state, 0) for state in (WAITING, QUEUED, DONE, CANCELLED)})
+        return stats
@@ -0,0 +1,194 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+from werkzeug.exceptions import HTTPException
+
+
+logger = logging.getLogger(__name__)
+
+# Enregistrement des livraisons pour bench.replay, désactivé si WEBHOOK_RECORD_PATH est vide.
+# Le chemin peut contenir {pid} pour séparer les fichiers des workers gunicorn.
+RECORD_PATH = os.environ.get('WEBHOOK_RECORD_PATH', '')
+RECORD_MAX_BYTES = int(os.environ.get('WEBHOOK_RECORD_MAX_BYTES', str(64 * 1024 * 1024)))
+RECORD_BACKUPS = int(os.environ.get('WEBHOOK_RECORD_BACKUPS', '10'))
+RECORD_GZIP = os.environ.get('WEBHOOK_RECORD_GZIP', '0') == '1'
+RECORD_QUEUE_MAX = int(os.environ.get('WEBHOOK_RECORD_QUEUE_MAX', '10000'))
+# Champs du corps (chemins pointés, les listes sont parcourues) et en-têtes masqués
+RECORD_REDACT = [path for path in os.environ.get('WEBHOOK_RECORD_REDACT', '').split(',') if path]
+RECORD_REDACT_HEADERS = [name for name in os.environ.get('WEBHOOK_RECORD_REDACT_HEADERS', '').split(',') if name]
+
+REDACTED = '[masqué]'
+
+
+def redact(value, path):
+    head, _, rest = path.partition('.')
+    if isinstance(value, list):
+        for item in value:
+            redact(item, path)
+    elif isinstance(value, dict) and head in value:
+        if rest:
+            redact(value[head], rest)
+        else:
+            value[head] = REDACTED
+
+
+class WebhookRecorder:
+    # Les requêtes ne font qu'une mise en file ; sérialisation, masquage, écriture et
+    # rotation se font dans un thread dédié. File pleine : l'enregistrement est perdu,
+    # jamais la livraison.
+    def __init__(self, path=RECORD_PATH, max_bytes=RECORD_MAX_BYTES, backups=RECORD_BACKUPS,
+                 compress=RECORD_GZIP, redact_fields=RECORD_REDACT, redact_headers=RECORD_REDACT_HEADERS,
+                 queue_max=RECORD_QUEUE_MAX):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.redact_fields = redact_fields
+        self.redact_headers = {name.lower() for name in redact_headers}
+        self.queue_max = queue_max
+        self._stats = {'recorded': 0, 'dropped': 0, 'rotations': 0, 'errors': 0}
+        self._init()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _init(self):
+        self._queue = queue.Queue(maxsize=self.queue_max)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._file = None
+
+    def after_fork(self):
+        self._init()
+
+    def init_app(self, app, paths=('/wcwebhook',)):
+        if not self.enabled:
+            return
+        paths = frozenset(paths)
+
+        @app.before_request
+        def start_recording():
+            if request.path in paths:
+                g.record_started = time.perf_counter()
+
+        @app.after_request
+        def record_delivery(response):
+            started = g.get('record_started')
+            if started is not None:
+                # La vue a lu le flux de la requête et laissé le corps brut dans g.raw_body
+                body = g.get('raw_body')
+                if body is None:
+                    body = b'' if response.status_code == 413 else self._request_body()
+                self.record(request.method, request.path, dict(request.headers), body,
+                            response.status_code, (time.perf_counter() - started) * 1000)
+            return response
+
+    @staticmethod
+    def _request_body():
+        # Corps refusé par Flask (MAX_CONTENT_LENGTH...) : on enregistre la livraison sans corps
+        try:
+            return request.get_data()
+        except HTTPException:
+            return b''
+
+    def record(self, method, path, headers, body, status, latency_ms):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), method, path, headers, body, status, latency_ms))
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name='webhook-recorder', daemon=True)
+                self._thread.start()
+
+    def _serialize(self, ts, method, path, headers, body, status, latency_ms):
+        headers = {name: (REDACTED if name.lower() in self.redact_headers else value)
+                   for name, value in headers.items()}
+        entry = {'ts': ts, 'method': method, 'path': path, 'headers': headers,
+                 'status': status, 'latency_ms': round(latency_ms, 3)}
+        if self.redact_fields:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            if data is not None:
+                for field in self.redact_fields:
+                    redact(data, field)
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        try:
+            entry['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['body_b64'] = base64.b64encode(body).decode('ascii')
+        return json.dumps(entry, ensure_ascii=False) + '\n'
+
+    def _current_path(self):
+        return self.path.format(pid=os.getpid())
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # On vide ce qui s'est accumulé pour n'écrire et ne flusher qu'une fois
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(''.join(self._serialize(*item) for item in batch).encode('utf-8'))
+                with self._lock:
+                    self._stats['recorded'] += len(batch)
+            except Exception as e:
+                logger.warning("Échec de l'enregistrement de %d livraisons : %s", len(batch), e)
+                with self._lock:
+                    self._stats['errors'] += 1
+
+    def _write(self, data):
+        if self._file is None:
+            self._file = open(self._current_path(), 'ab')
+        self._file.write(data)
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        current = self._current_path()
+        self._file.close()
+        self._file = None
+        stem = current[:-len('.jsonl')] if current.endswith('.jsonl') else current
+        rotated = f"{stem}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.jsonl"
+        if self.compress:
+            with open(current, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(current)
+        else:
+            os.rename(current, rotated)
+        with self._lock:
+            self._stats['rotations'] += 1
+        self._prune(stem)
+
+    def _prune(self, stem):
+        # Noms horodatés : l'ordre alphabétique est l'ordre chronologique
+        directory = os.path.dirname(stem) or '.'
+        prefix = os.path.basename(stem) + '-'
+        rotated = sorted(name for name in os.listdir(directory)
+                         if name.startswith(prefix) and name.endswith(('.jsonl', '.jsonl.gz')))
+        for name in rotated[:max(0, len(rotated) - self.backups)]:
+            os.remove(os.path.join(directory, name))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=self._queue.qsize())
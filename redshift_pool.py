@@ -0,0 +1,206 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+# Réglages du pool, surchargeables par variables d'environnement
+POOL_MIN = int(os.environ.get('REDSHIFT_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('REDSHIFT_POOL_MAX', '5'))
+POOL_TIMEOUT = float(os.environ.get('REDSHIFT_POOL_TIMEOUT', '10'))
+POOL_MAX_USES = int(os.environ.get('REDSHIFT_POOL_MAX_USES', '500'))
+POOL_MAX_IDLE = float(os.environ.get('REDSHIFT_POOL_MAX_IDLE', '300'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _is_connection_error(error):
+    # psycopg2 n'est importé que par la fonction de connexion : s'il n'est pas
+    # chargé, l'erreur ne peut pas venir de lui
+    psycopg2 = sys.modules.get('psycopg2')
+    return psycopg2 is not None and isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+
+class ConnectionPool:
+    def __init__(self, connect, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 max_uses=POOL_MAX_USES, max_idle=POOL_MAX_IDLE, name='redshift'):
+        self._connect = connect
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'timeouts': 0,
+            'ping_failures': 0,
+            'recycled': 0,
+            'wait_seconds_total': 0.0,
+        }
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return _PooledConnection(conn)
+
+    def _close(self, pooled, recycled=False):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['closed'] += 1
+            if recycled:
+                self._stats['recycled'] += 1
+
+    def _discard(self, pooled):
+        self._close(pooled)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _is_stale(self, pooled):
+        if self.max_uses and pooled.uses >= self.max_uses:
+            return True
+        if self.max_idle and time.monotonic() - pooled.last_used > self.max_idle:
+            return True
+        return False
+
+    def _ping(self, pooled):
+        try:
+            with pooled.conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            pooled.conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning("Connexion Redshift morte détectée au checkout : %s", e)
+            with self._cond:
+                self._stats['ping_failures'] += 1
+            return False
+
+    def _checkout(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # On réserve la place avant d'ouvrir la connexion hors du verrou
+                    self._size += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"Aucune connexion Redshift disponible après {self.timeout}s")
+                self._cond.wait(remaining)
+            self._stats['wait_seconds_total'] += time.monotonic() - start
+
+        if pooled is not None:
+            # Connexion trop vieille ou morte : on la remplace dans le même emplacement
+            stale = self._is_stale(pooled)
+            if stale or not self._ping(pooled):
+                self._close(pooled, recycled=stale)
+                pooled = None
+        if pooled is None:
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+        pooled.uses += 1
+        STAGE_SECONDS.observe(time.monotonic() - start, stage=f'{self.name}_connect')
+        return pooled
+
+    def _checkin(self, pooled, broken=False):
+        with self._cond:
+            self._in_use -= 1
+        if not broken and not pooled.conn.closed:
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                broken = True
+        if broken or pooled.conn.closed:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        pooled = self._checkout()
+        broken = False
+        try:
+            yield pooled.conn
+        except Exception as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            self._checkin(pooled, broken=broken)
+
+    def warmup(self):
+        # Ouvre minconn connexions pour que la première commande ne paie pas la connexion
+        opened = []
+        try:
+            for _ in range(self.minconn):
+                opened.append(self._checkout())
+        except Exception as e:
+            logger.warning("Préchauffage du pool Redshift incomplet : %s", e)
+        for pooled in opened:
+            self._checkin(pooled)
+        logger.info("Pool Redshift préchauffé avec %d connexion(s)", len(opened))
+
+    def start_warmup(self):
+        thread = threading.Thread(target=self.warmup, name='redshift-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def after_fork(self):
+        # Les sockets hérités du parent ne doivent pas être fermés ici (le message de
+        # fin de session partirait sur la connexion du parent) : on les oublie.
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self._size, in_use=self._in_use, idle=len(self._idle),
+                         min=self.minconn, max=self.maxconn)
+        return stats
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+
+# boto3 n'est importé qu'à la création du client : son import coûte à lui seul
+# plusieurs centaines de ms au démarrage d'un dyno.
+
+logger = logging.getLogger(__name__)
+
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '32'))
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', '5'))
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', str(16 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get('S3_MULTIPART_CHUNKSIZE', str(8 * 1024 * 1024)))
+S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', '8'))
+# Endpoint alternatif (S3 local pour les benchmarks), adressage par chemin dans ce cas
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+_lock = threading.Lock()
+_client = None
+_transfer_config = None
+
+
+def get_s3_client():
+    # Un seul client pour tout le processus : le modèle de service, la résolution
+    # d'endpoint et le pool HTTPS ne sont construits qu'une fois. Les clients boto3
+    # sont thread-safe, seule leur création doit être protégée.
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+
+                session = boto3.session.Session(
+                    aws_access_key_id=os.environ.get('AWS_ACCESS_KEY'),
+                    aws_secret_access_key=os.environ.get('AWS_SECRET_KEY'),
+                )
+                _client = session.client('s3', endpoint_url=S3_ENDPOINT_URL, config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'},
+                    tcp_keepalive=True,
+                    s3={'addressing_style': 'path'} if S3_ENDPOINT_URL else None,
+                ))
+    return _client
+
+
+def get_transfer_config():
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+    return _transfer_config
+
+
+def reset_s3_client():
+    # À appeler dans un processus enfant après fork : le pool HTTPS ne se partage pas
+    global _client
+    with _lock:
+        _client = None
+
+
+def start_warmup():
+    # Import de boto3 et création du client hors du chemin de la première commande
+    def warm():
+        try:
+            get_s3_client()
+            get_transfer_config()
+        except Exception as e:
+            logger.warning("Préchauffage du client S3 impossible : %s", e)
+    threading.Thread(target=warm, name='s3-warmup', daemon=True).start()
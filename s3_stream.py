@@ -0,0 +1,107 @@
+import csv
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# S3 impose 5 Mo minimum par part (sauf la dernière)
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = max(MIN_PART_SIZE, int(os.environ.get('S3_PART_SIZE', str(8 * 1024 * 1024))))
+# Nombre de parts envoyées en parallèle pendant que la requête continue à produire des lignes
+MAX_INFLIGHT_PARTS = int(os.environ.get('S3_MAX_INFLIGHT_PARTS', '2'))
+
+
+class MultipartCsvUpload:
+    def __init__(self, s3_client, bucket, key, header=None, part_size=PART_SIZE,
+                 max_inflight=MAX_INFLIGHT_PARTS):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_inflight = max(1, max_inflight)
+        self.rows = 0
+        self.bytes_uploaded = 0
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text)
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._inflight = []
+        self._uploader = None
+        if header:
+            self._writer.writerow(header)
+            self._drain_text()
+
+    def _drain_text(self):
+        self._buffer += self._text.getvalue().encode('utf-8')
+        self._text.seek(0)
+        self._text.truncate()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._writer.writerow(row)
+            self.rows += 1
+        self._drain_text()
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._send_part(part)
+
+    def _send_part(self, data):
+        if self._upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                              ContentType='text/csv')
+            self._upload_id = response['UploadId']
+            self._uploader = ThreadPoolExecutor(max_workers=self.max_inflight,
+                                                thread_name_prefix='s3-part')
+        # On borne le nombre de parts en vol pour garder la mémoire constante
+        if len(self._inflight) >= self.max_inflight:
+            self._parts.append(self._inflight.pop(0).result())
+        part_number = len(self._parts) + len(self._inflight) + 1
+        self.bytes_uploaded += len(data)
+        self._inflight.append(self._uploader.submit(self._upload_part, part_number, data))
+
+    def _upload_part(self, part_number, data):
+        response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key,
+                                              UploadId=self._upload_id,
+                                              PartNumber=part_number, Body=data)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        data = bytes(self._buffer)
+        self._buffer = bytearray()
+        if self._upload_id is None:
+            # Petit extrait : un seul PUT, pas de multipart
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=data,
+                                      ContentType='text/csv')
+            self.bytes_uploaded += len(data)
+            return self.bytes_uploaded
+        if data:
+            self._send_part(data)
+        try:
+            for future in self._inflight:
+                self._parts.append(future.result())
+            self._inflight = []
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                     UploadId=self._upload_id,
+                                                     MultipartUpload={'Parts': self._parts})
+        finally:
+            self._uploader.shutdown(wait=False)
+        logger.info("Upload multipart de %s terminé (%d parts, %d octets)",
+                    self.key, len(self._parts), self.bytes_uploaded)
+        return self.bytes_uploaded
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+        for future in self._inflight:
+            future.cancel()
+        self._uploader.shutdown(wait=True)
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                  UploadId=self._upload_id)
+        except Exception as e:
+            logger.warning("Impossible d'annuler l'upload multipart de %s : %s", self.key, e)
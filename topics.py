@@ -0,0 +1,18 @@
+class TopicRouter:
+    # Associe un sujet WooCommerce (X-WC-Webhook-Topic, ex. "order.updated") à son
+    # traitement. "<ressource>.*" couvre tous les événements d'une ressource.
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, *topics):
+        def decorator(fn):
+            for topic in topics:
+                self._handlers[topic] = fn
+            return fn
+        return decorator
+
+    def lookup(self, topic, resource=None):
+        handler = self._handlers.get(topic)
+        if handler is None and resource:
+            handler = self._handlers.get(f'{resource}.*')
+        return handler
@@ -0,0 +1,47 @@
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+UNLOAD_IAM_ROLE = os.environ.get('REDSHIFT_UNLOAD_IAM_ROLE')
+UNLOAD_PARALLEL = os.environ.get('REDSHIFT_UNLOAD_PARALLEL', 'on').lower() in ('1', 'on', 'true')
+UNLOAD_MAXFILESIZE_MB = int(os.environ.get('REDSHIFT_UNLOAD_MAXFILESIZE_MB', '1024'))
+
+
+def build_unload_sql(cursor, query, params, s3_prefix, iam_role, parallel=UNLOAD_PARALLEL,
+                     maxfilesize_mb=UNLOAD_MAXFILESIZE_MB):
+    # UNLOAD n'accepte pas de paramètres liés : on rend la requête via mogrify puis on
+    # double les quotes pour l'inclure comme littéral. Le SELECT est imbriqué car
+    # UNLOAD refuse un LIMIT au niveau le plus externe.
+    rendered = cursor.mogrify(query, params).decode('utf-8').strip().rstrip(';')
+    literal = f"SELECT * FROM ({rendered}) AS extrait".replace("'", "''")
+    return (
+        f"UNLOAD ('{literal}') TO '{s3_prefix}' "
+        f"IAM_ROLE '{iam_role}' "
+        f"FORMAT AS CSV HEADER "
+        f"PARALLEL {'ON' if parallel else 'OFF'} "
+        f"MAXFILESIZE {maxfilesize_mb} MB "
+        f"MANIFEST VERBOSE ALLOWOVERWRITE"
+    )
+
+
+def unload_to_s3(conn, s3_client, query, params, bucket, prefix, iam_role=UNLOAD_IAM_ROLE):
+    # Les noeuds de calcul écrivent directement dans le bucket ; on relit ensuite le
+    # manifeste pour connaître les fichiers produits et le nombre de lignes.
+    s3_prefix = f"s3://{bucket}/{prefix}"
+    with conn.cursor() as cursor:
+        cursor.execute(build_unload_sql(cursor, query, params, s3_prefix, iam_role))
+    conn.commit()
+
+    manifest_key = f"{prefix}manifest"
+    response = s3_client.get_object(Bucket=bucket, Key=manifest_key)
+    manifest = json.loads(response['Body'].read())
+    keys = []
+    for entry in manifest.get('entries', []):
+        url = entry['url']
+        keys.append(url.split(f"s3://{bucket}/", 1)[-1])
+    record_count = manifest.get('meta', {}).get('record_count')
+    logger.info("UNLOAD vers %s terminé (%d fichier(s), %s lignes)", s3_prefix, len(keys), record_count)
+    return {'manifest': manifest_key, 'keys': keys, 'nb_lignes': record_count}
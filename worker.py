@@ -0,0 +1,44 @@
+import logging
+import os
+import signal
+import threading
+
+# Le worker consomme toujours la file, avec sa propre concurrence, même si les dynos
+# web sont configurés pour ne pas le faire (variables partagées entre process types).
+os.environ['JOB_CONSUMERS'] = '1'
+os.environ['JOB_WORKERS'] = os.environ.get('WORKER_CONCURRENCY', os.environ.get('JOB_WORKERS', '4'))
+
+import app  # noqa: E402  enregistre get_dpe_data comme handler et démarre la consommation
+from jobs import JOB_QUEUE_URL, executor  # noqa: E402
+
+
+logger = logging.getLogger('worker')
+
+SHUTDOWN_TIMEOUT = float(os.environ.get('WORKER_SHUTDOWN_TIMEOUT', '25'))
+
+
+def main():
+    if not JOB_QUEUE_URL:
+        logger.error("JOB_QUEUE_URL n'est pas défini : le worker n'a pas de file à consommer.")
+        raise SystemExit(1)
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info("Signal %s reçu, arrêt du worker", signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logger.info("Worker d'extraction démarré (%d jobs simultanés)", executor.max_workers)
+    stop.wait()
+    # Heroku laisse 30 s entre SIGTERM et SIGKILL
+    if executor.stop(timeout=SHUTDOWN_TIMEOUT):
+        logger.info("Tous les jobs en cours sont terminés")
+    else:
+        logger.warning("Jobs encore en cours à l'arrêt : ils seront repris après expiration du bail")
+
+
+if __name__ == '__main__':
+    main()